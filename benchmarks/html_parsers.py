@@ -0,0 +1,75 @@
+"""Compare the HTML parser backends on real newsletter exports.
+
+Usage: python benchmarks/html_parsers.py export.zip [more.zip ...] [-n REPEAT]
+
+For every installed backend this times the read-only lookups (plain text of the
+whole document and an attribute lookup) and the section split, which runs on
+BeautifulSoup with the backend's tree builder.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import html_parser
+from main import read_zip_contents, parse_sections
+
+def load_export(path):
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zip_ref:
+            html_content, _ = read_zip_contents(zip_ref)
+        return html_content
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def time_call(func, repeat):
+    """Best time of repeat calls, in milliseconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+def benchmark(html_content, repeat):
+    results = {}
+    for backend in html_parser.available_backends():
+        html_parser.configure(backend)
+
+        def split():
+            with contextlib.redirect_stdout(io.StringIO()):
+                parse_sections(html_content)
+
+        results[backend] = {
+            "get_text": time_call(lambda: html_parser.get_text(html_content, backend), repeat),
+            "find_attribute": time_call(lambda: html_parser.find_attribute(html_content, 'img', {}, 'src', backend), repeat),
+            "parse_sections": time_call(split, repeat),
+            "tree_builder": html_parser.get_tree_builder(backend),
+        }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HTML parser backends on newsletter exports")
+    parser.add_argument("paths", nargs="+", help="Exported newsletter ZIPs or HTML files")
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="Runs per measurement (best is reported)")
+    args = parser.parse_args()
+
+    missing = [name for name in html_parser.PARSER_BACKENDS if not html_parser.backend_available(name)]
+    if missing:
+        print(f"Not installed: {', '.join(missing)}")
+
+    for path in args.paths:
+        html_content = load_export(path)
+        print(f"\n{path} ({len(html_content) / 1024:.1f} KB of HTML)")
+        print(f"{'backend':<12} {'get_text':>10} {'find_attr':>10} {'sections':>10}  tree builder")
+        for backend, timings in benchmark(html_content, args.repeat).items():
+            print(f"{backend:<12} {timings['get_text']:>8.2f}ms {timings['find_attribute']:>8.2f}ms "
+                  f"{timings['parse_sections']:>8.2f}ms  {timings['tree_builder']}")
+
+if __name__ == "__main__":
+    main()
@@ -46,3 +46,122 @@ social_data = [
         "social_image": "./assets/icons/mc_tiktok.png"
     },
 ]
+
+# Number of images uploaded in parallel (override with --workers)
+upload_workers = 4
+
+# Image upload cache (SQLite). An existing image_cache.json is imported on first use.
+image_cache_path = ".cache/image_cache.db"
+legacy_image_cache_path = "image_cache.json"
+
+# Precomputed asset manifest written by `python main.py manifest`
+asset_manifest_path = "asset_manifest.json"
+
+# Optional image optimisation before upload (needs Pillow, override with --optimise/--no-optimise).
+# Images are resized to the width they are rendered at, doubled when optimise_retina is on.
+optimise_images = False
+optimise_retina = True
+optimise_widths = {
+    "logo": 564,
+    "header": 552,
+    "social": 48,
+    "content": 300,
+}
+optimise_jpeg_quality = 82
+optimise_png_colors = 256  # 0 keeps PNGs lossless
+derived_image_dir = ".cache/derived"
+
+# HTTP connection pool size and timeouts (seconds) for postimages.org.
+# The pool is never smaller than the number of upload workers.
+http_pool_size = 10
+http_connect_timeout = 10
+http_read_timeout = 60
+
+# Cached postimages.org login (session cookies + API key), reused until it is this old
+credential_cache_path = ".cache/postimages_session.json"
+credential_ttl_hours = 12
+
+# Retries for rate limited (429), server (5xx) and network errors, with exponential backoff (seconds)
+upload_max_attempts = 5
+upload_backoff_base = 1.0
+upload_backoff_max = 60.0
+
+# Image host backend (override with --host):
+#   "postimages" - postimages.org, needs POSTIMAGES_EMAIL/POSTIMAGES_PASSWORD
+#   "local"      - content-addressed files under local_host_root, served from local_host_base_url
+#                  (file:// URLs when it is None)
+#   "fake"       - an in-process stand-in server for tests and offline benchmarks
+image_host = "postimages"
+local_host_root = "hosted"
+local_host_base_url = None
+fake_host_latency = 0.0
+fake_host_failure_rate = 0.0
+
+# HTML parser: "auto" (fastest installed), "selectolax", "lxml" or "html.parser".
+# Backends that are not installed fall back to the next fastest one. Section
+# splitting edits the tree, so it always uses BeautifulSoup, with lxml as the
+# tree builder when it is installed.
+html_parser_backend = "auto"
+
+# Compiled Jinja templates are cached here so a fresh run skips compiling them
+jinja_cache_dir = ".cache/jinja"
+
+# The static email shell (head, end and social block) is prerendered once per config and cached here
+frame_cache_dir = ".cache/frames"
+
+# Styles inlined onto the exported content. From the Google Docs stylesheet only these
+# properties are kept, so bold, italics, underlines and super/subscript survive while the
+# export's black Arial text does not override the newsletter's look.
+inline_css_properties = ("font-weight", "font-style", "text-decoration", "vertical-align")
+# House styles per tag, applied on top of the export's styles to elements that have a class from the export
+house_styles = {
+    "p": {
+        "color": "#F2F2F2",
+        "font-family": "Helvetica",
+        "font-size": "14px",
+        "font-weight": "bold",
+        "text-align": "center",
+        "margin": "10px 0",
+        "padding": "0",
+        "mso-line-height-rule": "exactly",
+        "-ms-text-size-adjust": "100%",
+        "-webkit-text-size-adjust": "100%",
+        "line-height": "150%",
+    },
+}
+house_attributes = {"p": {"dir": "ltr"}}
+
+# Minify the generated email (override with --minify/--no-minify)
+minify_output = False
+# Fail the build when the email is larger than this many KB (Gmail clips at ~102 KB), None to disable
+size_budget_kb = 102
+
+# Parsed and rendered sections are cached here so a re-export only reprocesses the sections
+# that changed (None to disable, or --no-section-cache for one run)
+section_cache_path = ".cache/sections.db"
+section_cache_max_age_days = 30
+
+# Issues processed in parallel by the batch command (None for one per CPU)
+batch_jobs = None
+
+# How often --watch checks the ZIP or drop folder for changes (seconds)
+watch_interval = 0.25
+
+# Port of the live preview server (python main.py preview export.zip)
+preview_port = 8000
+
+# Draft builds (--draft) never contact the image host: images are linked as file:// URLs,
+# or inlined as thumbnails no wider than draft_thumbnail_width with "data" (--draft-images data).
+# Thumbnails over draft_data_uri_max_kb are linked as files instead.
+draft_images = "file"
+draft_thumbnail_width = 300
+draft_data_uri_max_kb = 48
+# Images from the ZIP are copied here so file:// links keep working after the export is deleted
+draft_image_dir = ".cache/drafts"
+
+# Build service (python main.py serve): port, number of builds run at once, where uploaded
+# exports wait for their build, and the largest upload accepted
+service_port = 8080
+service_jobs = 2
+service_upload_dir = ".cache/uploads"
+service_max_upload_mb = 50
@@ -0,0 +1,45 @@
+import json
+import os
+
+def load_asset_manifest(manifest_path):
+    """Load the precomputed asset manifest ({path: {size, mtime_ns, inode, hash, url}})"""
+    if not manifest_path or not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Warning: Could not load asset manifest: {e}")
+        return {}
+
+def lookup_asset(manifest, path, transform=None, host="postimages"):
+    """Return the manifest entry for a local asset if the file is unchanged since the manifest was written
+    and its URL was produced by the same host with the same optimisation transform"""
+    entry = manifest.get(os.path.normpath(path))
+    if not entry or entry.get("transform") != transform or entry.get("host", "postimages") != host:
+        return None
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    if (entry.get("size"), entry.get("mtime_ns"), entry.get("inode")) != (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino):
+        return None
+    return entry
+
+def make_asset_entry(path, file_hash, url, transform=None, host="postimages"):
+    """Build a manifest entry for a local asset from its current stat"""
+    stat_result = os.stat(path)
+    return {
+        "size": stat_result.st_size,
+        "mtime_ns": stat_result.st_mtime_ns,
+        "inode": stat_result.st_ino,
+        "hash": file_hash,
+        "url": url,
+        "transform": transform,
+        "host": host,
+    }
+
+def save_asset_manifest(manifest_path, manifest):
+    """Write the asset manifest"""
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
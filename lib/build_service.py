@@ -0,0 +1,272 @@
+import contextvars
+import io
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Upload form; uploads and polls the job list with fetch(), or posts the form as is without JavaScript
+INDEX_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>MPS Newsletter Generator</title>
+<style>
+body { font-family: Helvetica, Arial, sans-serif; margin: 2em auto; max-width: 50em; }
+table { border-collapse: collapse; width: 100%; margin-top: 1em; }
+td, th { border-bottom: 1px solid #ddd; padding: 0.4em; text-align: left; }
+.failed { color: #b00; }
+</style>
+</head>
+<body>
+<h1>MPS Newsletter Generator</h1>
+<form id="upload" action="/jobs" method="post" enctype="multipart/form-data">
+<input type="file" name="export" accept=".zip" multiple required>
+<button type="submit">Build</button>
+</form>
+<table>
+<thead><tr><th>Export</th><th>Status</th><th>Time</th><th></th></tr></thead>
+<tbody id="jobs"></tbody>
+</table>
+<script>
+function escape(text) {
+  return String(text).replace(/[&<>"]/g, function (c) { return "&#" + c.charCodeAt(0) + ";"; });
+}
+function refresh() {
+  fetch("/jobs").then(function (response) { return response.json(); }).then(function (jobs) {
+    document.getElementById("jobs").innerHTML = jobs.map(function (job) {
+      var links = '<a href="' + job.log_url + '">log</a>';
+      if (job.email_url) links = '<a href="' + job.email_url + '">download</a> ' + links;
+      var status = job.status + (job.error ? ": " + job.error : "");
+      return "<tr><td>" + escape(job.filename) + '</td><td class="' + job.status + '">' + escape(status) +
+             "</td><td>" + (job.seconds === null ? "" : job.seconds.toFixed(1) + "s") + "</td><td>" + links + "</td></tr>";
+    }).join("");
+  });
+}
+document.getElementById("upload").onsubmit = function (event) {
+  event.preventDefault();
+  var files = Array.from(event.target.export.files);
+  Promise.all(files.map(function (file) {
+    return fetch("/jobs?name=" + encodeURIComponent(file.name), {method: "POST", body: file});
+  })).then(function () { event.target.reset(); refresh(); });
+};
+refresh();
+setInterval(refresh, 1000);
+</script>
+</body>
+</html>"""
+
+class Job:
+    """A newsletter build submitted to the service"""
+
+    def __init__(self, filename, zip_path=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.filename = filename
+        self.zip_path = zip_path
+        self.status = "queued"
+        self.error = None
+        self.output_path = None
+        self.log = io.StringIO()
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        seconds = None
+        if self.started_at:
+            seconds = (self.finished_at or time.time()) - self.started_at
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "seconds": seconds,
+            "email_url": f"/jobs/{self.id}/email" if self.output_path else None,
+            "log_url": f"/jobs/{self.id}/log",
+        }
+
+class JobOutput:
+    """Replacement for sys.stdout that sends what a job prints to that job's log.
+
+    The log is held in a context variable, so worker threads a build starts with
+    the build's context (see main.submit_in_context()) write to the job's log too.
+    Output from anywhere else goes to the original stream.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.log = contextvars.ContextVar("job_log", default=None)
+
+    def write(self, text):
+        return (self.log.get() or self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+class BuildService(ThreadingHTTPServer):
+    """HTTP service that builds uploaded newsletter exports on a pool of worker threads.
+
+    POST /jobs takes a ZIP (a multipart form upload, or the raw ZIP as the body
+    with ?name=) and answers at once with the queued job. build(job) is called on
+    one of jobs worker threads and returns the path of the generated email; any
+    exception fails the job. GET /jobs lists the jobs, GET /jobs/<id> shows one,
+    and /jobs/<id>/email and /jobs/<id>/log download its result and output.
+    Print output from builds goes to the job's log while server.output is
+    installed as sys.stdout.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, build, upload_dir, jobs=2, max_upload_mb=50):
+        super().__init__(address, BuildRequestHandler)
+        self.build = build
+        self.upload_dir = upload_dir
+        self.max_upload_bytes = max_upload_mb * 1024 * 1024
+        self.jobs = {}
+        self.jobs_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.output = JobOutput(sys.stdout)
+        self.url = f"http://{self.server_address[0]}:{self.server_address[1]}/"
+        os.makedirs(upload_dir, exist_ok=True)
+
+    def submit(self, filename, data):
+        """Save an uploaded ZIP and queue a build of it, returning the job"""
+        job = Job(os.path.basename(filename or "newsletter.zip"))
+        job.zip_path = os.path.join(self.upload_dir, f"{job.id}.zip")
+        with open(job.zip_path, "wb") as f:
+            f.write(data)
+        with self.jobs_lock:
+            self.jobs[job.id] = job
+        self.executor.submit(self._run, job)
+        print(f"📥 Queued {job.filename} as job {job.id}")
+        return job
+
+    def _run(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+        token = self.output.log.set(job.log)
+        try:
+            job.output_path = self.build(job)
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+            job.status = "failed"
+            job.log.write(traceback.format_exc())
+        finally:
+            self.output.log.reset(token)
+            job.finished_at = time.time()
+            # The export is not needed once the email is built
+            try:
+                os.remove(job.zip_path)
+            except OSError:
+                pass
+        icon = "✅" if job.status == "done" else "❌"
+        print(f"{icon} Job {job.id} ({job.filename}) {job.status} in {job.finished_at - job.started_at:.1f}s")
+
+    def get_job(self, job_id):
+        with self.jobs_lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        """Every job, newest first"""
+        with self.jobs_lock:
+            jobs = list(self.jobs.values())
+        return sorted(jobs, key=lambda job: job.submitted_at, reverse=True)
+
+    def server_close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        super().server_close()
+
+def read_uploads(content_type, body):
+    """The (filename, data) of every file in a multipart/form-data body"""
+    message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body)
+    if not message.is_multipart():
+        return []
+    return [(part.get_filename(), part.get_payload(decode=True)) for part in message.iter_parts() if part.get_filename()]
+
+class BuildRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, value):
+        return self.send(status, json.dumps(value).encode("utf-8"), 'application/json')
+
+    def send_error_json(self, status, message):
+        return self.send_json(status, {"error": message})
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path).path.strip('/').split('/')
+        if parts == ['']:
+            return self.send(200, INDEX_PAGE.encode("utf-8"), 'text/html; charset=utf-8')
+        if parts == ['jobs']:
+            return self.send_json(200, [job.to_dict() for job in server.list_jobs()])
+        if parts[0] != 'jobs' or len(parts) > 3:
+            return self.send_error_json(404, "Not found")
+
+        job = server.get_job(parts[1])
+        if job is None:
+            return self.send_error_json(404, "No such job")
+        if len(parts) == 2:
+            return self.send_json(200, job.to_dict())
+        if parts[2] == 'log':
+            return self.send(200, job.log.getvalue().encode("utf-8"), 'text/plain; charset=utf-8')
+        if parts[2] == 'email':
+            if not job.output_path:
+                return self.send_error_json(409, f"Job is {job.status}, there is no email to download")
+            with open(job.output_path, "rb") as f:
+                body = f.read()
+            filename = os.path.basename(job.output_path)
+            return self.send(200, body, 'text/html; charset=utf-8',
+                             {'Content-Disposition': f'attachment; filename="{filename}"'})
+        return self.send_error_json(404, "Not found")
+
+    def do_POST(self):
+        server = self.server
+        url = urlsplit(self.path)
+        if url.path.rstrip('/') != '/jobs':
+            return self.send_error_json(404, "Not found")
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0:
+            return self.send_error_json(411, "Send the ZIP file with a Content-Length")
+        if length > server.max_upload_bytes:
+            return self.send_error_json(413, f"Uploads are limited to {server.max_upload_bytes // (1024 * 1024)} MB")
+        body = self.rfile.read(length)
+
+        content_type = self.headers.get('Content-Type', '')
+        form_upload = content_type.startswith('multipart/form-data')
+        if form_upload:
+            uploads = read_uploads(content_type, body)
+        else:
+            uploads = [(parse_qs(url.query).get('name', [None])[0], body)]
+        if not uploads or not all(data and zipfile.is_zipfile(io.BytesIO(data)) for filename, data in uploads):
+            return self.send_error_json(400, "Upload the newsletter as a ZIP file exported from Google Docs")
+
+        jobs = [server.submit(filename, data) for filename, data in uploads]
+        if form_upload:
+            # Browsers without JavaScript go back to the job list
+            return self.send(303, b'', 'text/plain', {'Location': '/'})
+        return self.send_json(202, jobs[0].to_dict())
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import re
+import threading
+
+COMMENT_PATTERN = re.compile(r"/\*.*?\*/", re.DOTALL)
+# Statement at-rules such as @import url(...);
+AT_STATEMENT_PATTERN = re.compile(r"@[\w-]+[^;{]*;")
+# The only selectors inlined: .class and tag.class
+CLASS_SELECTOR_PATTERN = re.compile(r"^([a-zA-Z][a-zA-Z0-9]*)?\.([\w-]+)$")
+
+# Declarations that only restate a property's initial value. Google Docs writes these on
+# every span, and inlined they would override the house style the element inherits.
+INITIAL_VALUES = {
+    "font-weight": ("400", "normal"),
+    "font-style": ("normal",),
+    "text-decoration": ("none",),
+    "vertical-align": ("baseline",),
+}
+
+_inliners = {}
+_inliners_lock = threading.Lock()
+
+def parse_declarations(body):
+    """Parse "a: b; c: d" into an ordered {property: value} dict"""
+    declarations = {}
+    for declaration in body.split(";"):
+        name, colon, value = declaration.partition(":")
+        name, value = name.strip().lower(), value.strip()
+        if colon and name and value:
+            declarations[name] = value
+    return declarations
+
+def format_declarations(declarations):
+    return "".join(f"{name}: {value};" for name, value in declarations.items())
+
+def parse_stylesheet(css):
+    """Index the class rules of a stylesheet as {class: [(tag or None, declarations, order)]}.
+
+    Anything other than .class and tag.class selectors (descendant and list marker
+    selectors, at-rules) is skipped, as email clients would ignore it anyway.
+    """
+    css = AT_STATEMENT_PATTERN.sub("", COMMENT_PATTERN.sub("", css))
+    index = {}
+    order = 0
+    position = 0
+    while True:
+        brace = css.find("{", position)
+        if brace == -1:
+            break
+        prelude = css[position:brace].strip()
+
+        # Skip block at-rules (@media, @font-face...) including any nested blocks
+        if prelude.startswith("@"):
+            depth, position = 1, brace + 1
+            while depth and position < len(css):
+                depth += {"{": 1, "}": -1}.get(css[position], 0)
+                position += 1
+            continue
+
+        end = css.find("}", brace)
+        if end == -1:
+            break
+        declarations = parse_declarations(css[brace + 1:end])
+        position = end + 1
+
+        for selector in prelude.split(","):
+            match = CLASS_SELECTOR_PATTERN.match(selector.strip())
+            if match and declarations:
+                tag, class_name = match.groups()
+                index.setdefault(class_name, []).append((tag.lower() if tag else None, declarations, order))
+                order += 1
+    return index
+
+class CssInliner:
+    """Inlines the export's class styles and the house styles onto elements.
+
+    Only the properties in allowed_properties are taken from the export's
+    stylesheet; house_styles ({tag: {property: value}}) are applied on top of them
+    and house_attributes ({tag: {attribute: value}}) are added, for elements that
+    carry a class from the export.
+    """
+
+    def __init__(self, stylesheet, allowed_properties=(), house_styles=None, house_attributes=None):
+        self.index = parse_stylesheet(stylesheet)
+        self.allowed_properties = set(allowed_properties)
+        self.house_styles = house_styles or {}
+        self.house_attributes = house_attributes or {}
+        self._resolved = {}
+
+    def resolve(self, tag, classes):
+        """Declarations from the stylesheet for a tag with the given classes, in cascade order"""
+        key = (tag, tuple(classes))
+        if key in self._resolved:
+            return self._resolved[key]
+
+        matches = []
+        for class_name in classes:
+            for rule_tag, declarations, order in self.index.get(class_name, ()):
+                if rule_tag is None or rule_tag == tag:
+                    # tag.class is more specific than .class
+                    matches.append((rule_tag is not None, order, declarations))
+
+        resolved = {}
+        for _, _, declarations in sorted(matches, key=lambda match: match[:2]):
+            for name, value in declarations.items():
+                if name in self.allowed_properties and value.lower() not in INITIAL_VALUES.get(name, ()):
+                    resolved[name] = value
+        self._resolved[key] = resolved
+        return resolved
+
+    def inline(self, element):
+        """Write the resolved style onto an element that has a class from the export"""
+        classes = element.get("class")
+        if not classes:
+            return
+        declarations = dict(self.resolve(element.name, classes))
+        # The element's own style attribute wins over its classes, and the house style over both
+        declarations.update(parse_declarations(element.get("style", "")))
+        declarations.update(self.house_styles.get(element.name, {}))
+
+        for name, value in self.house_attributes.get(element.name, {}).items():
+            element[name] = value
+        if declarations:
+            element["style"] = format_declarations(declarations)
+
+def get_inliner(stylesheet, allowed_properties=(), house_styles=None, house_attributes=None):
+    """CssInliner for a stylesheet, built once per stylesheet and settings"""
+    key = hashlib.sha256(json.dumps([stylesheet, sorted(allowed_properties), house_styles, house_attributes],
+                                    sort_keys=True).encode("utf-8")).hexdigest()
+    with _inliners_lock:
+        inliner = _inliners.get(key)
+        if inliner is None:
+            inliner = _inliners[key] = CssInliner(stylesheet, allowed_properties, house_styles, house_attributes)
+    return inliner
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+from lib.templates import end_after_social
+from lib.template_env import TEMPLATE_SOURCES, get_template
+from lib.minifier import minify_html
+
+# The parts of the email between the static text, in the order they appear.
+# The social block is static too but is kept apart so its size can be reported.
+SLOTS = ("email_subject", "email_start", "sections", "email_end", "social")
+SLOT_PATTERN = re.compile(r"@@MPS_SLOT_(\w+)@@")
+# Bump when the layout of cached frames changes
+FRAME_VERSION = 3
+
+_frames = {}
+_frames_lock = threading.Lock()
+
+def get_slot_marker(name):
+    return f"@@MPS_SLOT_{name}@@"
+
+def get_frame_key(logo_url, social_data, minify=False):
+    """Hash of everything the static shell depends on: the template sources and the resolved config"""
+    key_data = {
+        "version": FRAME_VERSION,
+        "minify": minify,
+        "templates": {name: TEMPLATE_SOURCES[name] for name in ("start", "end", "social")},
+        "end_after_social": end_after_social,
+        "logo": logo_url,
+        "social": [[social["social_link"], social["social_image"]] for social in social_data],
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode("utf-8")).hexdigest()
+
+def render_frame(logo_url, social_data, minify=False):
+    """Render the static shell with markers in the dynamic slots.
+
+    Returns {"parts": [...], "social": html}, where parts alternate between static
+    text and slot names: [text, slot, text, slot, ..., text].
+    """
+    start_html = get_template("start").render(
+        email_start=get_slot_marker("email_start"),
+        header_image=logo_url,
+        email_subject=get_slot_marker("email_subject"),
+    )
+    end_html = get_template("end").render(email_end=get_slot_marker("email_end"))
+
+    socials = get_template("social")
+    social_html = "".join(
+        socials.render(social_link=social["social_link"], social_image=social["social_image"])
+        for social in social_data
+    )
+
+    frame_html = start_html + get_slot_marker("sections") + end_html + get_slot_marker("social") + end_after_social
+    if minify:
+        frame_html = minify_html(frame_html)
+        social_html = minify_html(social_html)
+    return {"parts": SLOT_PATTERN.split(frame_html), "social": social_html}
+
+def load_frame(cache_dir, logo_url, social_data, minify=False):
+    """Return the prerendered shell for this config, rendering it only on the first use.
+
+    Frames are kept in memory for the life of the process and on disk under
+    cache_dir (when set), keyed by get_frame_key().
+    """
+    key = get_frame_key(logo_url, social_data, minify)
+    with _frames_lock:
+        if key in _frames:
+            return _frames[key]
+
+    path = os.path.join(cache_dir, f"{key}.json") if cache_dir else None
+    frame = None
+    if path and os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                frame = json.load(f)
+        except (OSError, ValueError):
+            frame = None
+
+    if frame is None:
+        frame = render_frame(logo_url, social_data, minify)
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(frame, f)
+            os.replace(tmp_path, path)
+
+    with _frames_lock:
+        _frames[key] = frame
+    return frame
+
+def generate_frame(frame, values):
+    """Yield the email as (label, chunk) pairs.
+
+    Static text is labelled "shell" and a string slot value gets the slot's name.
+    A slot value can also be an iterable of (label, chunk) pairs, which are passed
+    through as they are, so each section can be labelled on its own.
+    """
+    values = dict(values, social=frame["social"])
+    for i, part in enumerate(frame["parts"]):
+        if i % 2 == 0:
+            if part:
+                yield "shell", part
+            continue
+        value = values.get(part, "")
+        if isinstance(value, str):
+            if value:
+                yield part, value
+        else:
+            yield from value
@@ -0,0 +1,106 @@
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+except ImportError:  # lxml is optional, html.parser is used without it
+    lxml = None
+
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:  # selectolax is optional too
+    HTMLParser = None
+
+# Fastest first, "auto" picks the first one that is installed
+PARSER_BACKENDS = ("selectolax", "lxml", "html.parser")
+
+_default_backend = "auto"
+_warned = set()
+
+def backend_available(name):
+    """Whether the library behind a parser backend is installed"""
+    if name == "selectolax":
+        return HTMLParser is not None
+    if name == "lxml":
+        return lxml is not None
+    return name == "html.parser"
+
+def available_backends():
+    return [name for name in PARSER_BACKENDS if backend_available(name)]
+
+def resolve_backend(name=None):
+    """Turn a backend setting ("auto" or a name from PARSER_BACKENDS) into an installed backend.
+
+    A backend that is not installed falls back to the next fastest one that is,
+    with a warning printed once.
+    """
+    name = name or _default_backend
+    if name == "auto":
+        return available_backends()[0]
+    if name not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown HTML parser backend: {name} (choose from auto, {', '.join(PARSER_BACKENDS)})")
+    if backend_available(name):
+        return name
+
+    fallback = available_backends()[0]
+    if name not in _warned:
+        _warned.add(name)
+        print(f"⚠️ HTML parser backend {name} is not installed, using {fallback}")
+    return fallback
+
+def configure(name):
+    """Set the backend used when call sites do not pass one"""
+    global _default_backend
+    resolve_backend(name)
+    _default_backend = name
+
+def get_tree_builder(backend=None):
+    """BeautifulSoup tree builder for code that needs a mutable tree.
+
+    selectolax cannot build a BeautifulSoup tree, so it uses lxml when that is
+    installed and html.parser otherwise.
+    """
+    backend = resolve_backend(backend)
+    if backend != "html.parser" and lxml is not None:
+        return "lxml"
+    return "html.parser"
+
+def make_soup(html_content, backend=None):
+    """Parse HTML into a BeautifulSoup tree with the best tree builder for the backend"""
+    return BeautifulSoup(html_content, get_tree_builder(backend))
+
+def find_attribute(html_content, tag, attrs, attribute, backend=None):
+    """Return an attribute of the first <tag> whose attributes match attrs, or None"""
+    if not html_content or not html_content.strip():
+        return None
+    backend = resolve_backend(backend)
+
+    if backend == "selectolax":
+        selector = tag + "".join(f'[{name}="{value}"]' for name, value in attrs.items())
+        node = HTMLParser(html_content).css_first(selector)
+        return node.attributes.get(attribute) if node is not None else None
+
+    if backend == "lxml":
+        document = lxml.html.fromstring(html_content)
+        for element in document.iter(tag):
+            if all(element.get(name) == value for name, value in attrs.items()):
+                return element.get(attribute)
+        return None
+
+    element = BeautifulSoup(html_content, "html.parser").find(tag, attrs)
+    return element.get(attribute) if element is not None else None
+
+def get_text(html_content, backend=None):
+    """Plain text of an HTML document or fragment"""
+    if not html_content or not html_content.strip():
+        return ""
+    backend = resolve_backend(backend)
+
+    if backend == "selectolax":
+        tree = HTMLParser(html_content)
+        root = tree.body or tree.root
+        return root.text() if root is not None else ""
+
+    if backend == "lxml":
+        return lxml.html.fromstring(html_content).text_content()
+
+    return BeautifulSoup(html_content, "html.parser").get_text()
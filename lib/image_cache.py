@@ -0,0 +1,237 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+from urllib.request import url2pathname
+
+import requests
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    hash TEXT PRIMARY KEY,
+    url TEXT,
+    page_url TEXT,
+    size INTEGER,
+    uploaded_at REAL,
+    verified_at REAL
+);
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+class ImageCache:
+    """SQLite backed cache of uploaded images keyed by the SHA256 hash of the image.
+
+    Every upload is committed as soon as it is recorded, so an interrupted run keeps
+    the URLs it already obtained. The database runs in WAL mode with a busy timeout
+    so several runs can share it, and a lock serialises access between threads.
+    """
+
+    def __init__(self, db_path, legacy_json_path=None):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+        if legacy_json_path and self.get_meta("json_imported") is None and os.path.exists(legacy_json_path):
+            imported = self.import_json(legacy_json_path)
+            print(f"✅ Imported {imported} entries from {legacy_json_path} into {db_path}")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def __contains__(self, file_hash):
+        return self.get(file_hash) is not None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, file_hash):
+        """Return the hosted URL for an image hash, or None if it is not cached
+        (or only its page URL is known so far)"""
+        with self._lock:
+            row = self._conn.execute("SELECT url FROM images WHERE hash = ?", (file_hash,)).fetchone()
+        return row["url"] if row else None
+
+    def get_entry(self, file_hash):
+        """Return the full cache entry for an image hash as a dict, or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM images WHERE hash = ?", (file_hash,)).fetchone()
+        return dict(row) if row else None
+
+    def put(self, file_hash, url, page_url=None, size=None, uploaded_at=None):
+        """Record an uploaded image, committing immediately"""
+        uploaded_at = uploaded_at if uploaded_at is not None else time.time()
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO images (hash, url, page_url, size, uploaded_at, verified_at)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(hash) DO UPDATE SET
+                       url = excluded.url,
+                       page_url = COALESCE(excluded.page_url, images.page_url),
+                       size = COALESCE(excluded.size, images.size),
+                       uploaded_at = excluded.uploaded_at,
+                       verified_at = excluded.verified_at""",
+                (file_hash, url, page_url, size, uploaded_at, uploaded_at),
+            )
+
+    def set_url(self, file_hash, url):
+        """Fill in the direct URL of an entry that so far only had its page URL"""
+        with self._lock:
+            self._conn.execute("UPDATE images SET url = ?, verified_at = ? WHERE hash = ?", (url, time.time(), file_hash))
+
+    def mark_verified(self, file_hash, verified_at=None):
+        """Update the last-verified time of an entry"""
+        verified_at = verified_at if verified_at is not None else time.time()
+        with self._lock:
+            self._conn.execute("UPDATE images SET verified_at = ? WHERE hash = ?", (verified_at, file_hash))
+
+    def mark_used(self, file_hashes, used_at=None):
+        """Refresh the last-verified time of every entry a build used, in one transaction,
+        so prune(older_than_days) keeps images that are still in use"""
+        used_at = used_at if used_at is not None else time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany("UPDATE images SET verified_at = ? WHERE hash = ?",
+                                   [(used_at, file_hash) for file_hash in set(file_hashes)])
+
+    def delete(self, file_hashes):
+        """Remove entries from the cache, returning how many were removed"""
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            cursor = self._conn.executemany("DELETE FROM images WHERE hash = ?", [(h,) for h in file_hashes])
+            return cursor.rowcount
+
+    def entries(self):
+        """Return all cache entries as a list of dicts"""
+        with self._lock:
+            return [dict(row) for row in self._conn.execute("SELECT * FROM images ORDER BY uploaded_at")]
+
+    def get_memoised_hash(self, path, stat_result):
+        """Return the memoised hash of a local file if its size, mtime and inode are unchanged"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT hash FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+                (os.path.abspath(path), stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino),
+            ).fetchone()
+        return row["hash"] if row else None
+
+    def memoise_hash(self, path, stat_result, file_hash):
+        """Remember the hash of a local file for the given stat result"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, inode, hash) VALUES (?, ?, ?, ?, ?)",
+                (os.path.abspath(path), stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino, file_hash),
+            )
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def import_json(self, json_path):
+        """Import a legacy image_cache.json ({hash: url}) in a single transaction.
+
+        Existing entries are kept; returns the number of entries imported.
+        """
+        with open(json_path, 'r') as f:
+            legacy = json.load(f)
+
+        imported_at = os.path.getmtime(json_path)
+        rows = [(file_hash, url, imported_at) for file_hash, url in legacy.items() if url]
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO images (hash, url, uploaded_at) VALUES (?, ?, ?)",
+                rows,
+            )
+            imported = self._conn.total_changes - before
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('json_imported', ?)",
+                (os.path.abspath(json_path),),
+            )
+        return imported
+
+    @staticmethod
+    def check_url(url, timeout=10):
+        """Whether a cached URL still serves its image, or None when its scheme cannot be checked.
+
+        file:// URLs (from the local host) are checked on disk, http(s) URLs with a HEAD request.
+        """
+        parts = urlsplit(url)
+        if parts.scheme == "file":
+            return os.path.exists(url2pathname(parts.path))
+        if parts.scheme not in ("http", "https"):
+            return None
+        try:
+            response = requests.head(url, timeout=timeout, allow_redirects=True)
+            return response.status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def prune(self, older_than_days=None, check_urls=False, timeout=10):
+        """Evict stale entries from the cache.
+
+        With older_than_days, entries not uploaded, used by a build or verified within
+        that many days are removed. With check_urls, every remaining URL is checked (see check_url()):
+        live ones get their verified time refreshed and dead ones are removed.
+        Returns the number of entries removed.
+        """
+        removed = 0
+        if older_than_days is not None:
+            cutoff = time.time() - older_than_days * 86400
+            with self._lock, self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                cursor = self._conn.execute(
+                    "DELETE FROM images WHERE COALESCE(verified_at, uploaded_at, 0) < ?",
+                    (cutoff,),
+                )
+                removed += cursor.rowcount
+
+        if check_urls:
+            dead = []
+            for entry in self.entries():
+                if not entry["url"]:
+                    continue
+                alive = self.check_url(entry["url"], timeout)
+                if alive is None:
+                    continue
+                if alive:
+                    self.mark_verified(entry["hash"])
+                else:
+                    print(f"❌ Dead URL: {entry['url']}")
+                    dead.append(entry["hash"])
+            removed += self.delete(dead)
+
+        return removed
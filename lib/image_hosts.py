@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import pathlib
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+
+import requests
+
+from lib.postimages_login import (get_authenticated_session, upload_image, extract_direct_image_url,
+                                  TransientUploadError, get_retry_after)
+
+class ImageHost:
+    """Somewhere newsletter images can be uploaded to.
+
+    upload() returns {'url': page_url, 'direct_link': direct_url}, where direct_link
+    may be missing if it could not be read yet (resolve_direct_link() retries that).
+    Hosts raise AuthenticationError when their login is rejected and
+    TransientUploadError for failures worth retrying.
+    """
+
+    # Name used on the command line and in config.py
+    name = None
+    # Prefix for image cache keys so URLs from different hosts never mix (None for postimages)
+    cache_namespace = None
+    # Whether hosted URLs outlive the process and may be stored in the image cache
+    persistent = True
+
+    def __init__(self):
+        self.auth_generation = 0
+
+    def authenticate(self, force_refresh=False, stale_generation=None):
+        """Make sure the host is ready for uploads, returning False if it is not.
+
+        When force_refresh is set, the login is only renewed if auth_generation is
+        still stale_generation, so several workers hitting the same rejected login
+        log in again just once.
+        """
+        return True
+
+    def upload(self, filename, fileobj):
+        raise NotImplementedError
+
+    def resolve_direct_link(self, page_url):
+        return None
+
+    def close(self):
+        pass
+
+class PostImagesHost(ImageHost):
+    """postimages.org, driven through its login form and upload endpoint"""
+
+    name = "postimages"
+
+    def __init__(self, session, credential_cache_path=None, credential_ttl_seconds=12 * 3600):
+        super().__init__()
+        self.session = session
+        self.credential_cache_path = credential_cache_path
+        self.credential_ttl_seconds = credential_ttl_seconds
+        self.api_key = None
+        self._auth_lock = threading.Lock()
+
+    def authenticate(self, force_refresh=False, stale_generation=None):
+        with self._auth_lock:
+            if self.api_key and not force_refresh:
+                return True
+            # Another worker may already have logged in again
+            if force_refresh and stale_generation is not None and stale_generation != self.auth_generation:
+                return True
+            if force_refresh:
+                print("🔑 Login rejected, logging in again...")
+            session, api_key = get_authenticated_session(self.session, self.credential_cache_path,
+                                                         self.credential_ttl_seconds, force_refresh)
+            if not session:
+                return False
+            self.session = session
+            self.api_key = api_key
+            self.auth_generation += 1
+            return True
+
+    def upload(self, filename, fileobj):
+        return upload_image(self.session, self.api_key, filename, fileobj)
+
+    def resolve_direct_link(self, page_url):
+        return extract_direct_image_url(page_url, self.session)
+
+    def close(self):
+        self.session.close()
+
+class LocalDirectoryHost(ImageHost):
+    """Content-addressed files under a directory that is served as static files.
+
+    Each image is written once as <root>/<sha256[:2]>/<sha256><ext>. Its URL is
+    base_url plus that path, or a file:// URL when no base_url is configured.
+    """
+
+    name = "local"
+    cache_namespace = "local"
+
+    def __init__(self, root, base_url=None):
+        super().__init__()
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip('/') + '/' if base_url else pathlib.Path(self.root).as_uri() + '/'
+        os.makedirs(self.root, exist_ok=True)
+
+    def upload(self, filename, fileobj):
+        data = fileobj.read()
+        digest = hashlib.sha256(data).hexdigest()
+        relative_path = f"{digest[:2]}/{digest}{os.path.splitext(filename)[1].lower()}"
+        path = os.path.join(self.root, relative_path)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        url = self.base_url + relative_path
+        return {'url': url, 'direct_link': url}
+
+    def resolve_direct_link(self, page_url):
+        return page_url
+
+class FakeImageServer(ThreadingHTTPServer):
+    """In-process stand-in for an image host, keeping uploads in memory.
+
+    POST /upload stores the request body and answers like postimages.org's JSON
+    endpoint. GET /page/<id> serves a share page with an og:image tag, and
+    GET /i/<id>/<name> serves the image itself. latency delays every request, and
+    failure_rate answers that share of uploads with a 429.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        super().__init__(('127.0.0.1', 0), FakeImageRequestHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.images = {}
+        self.lock = threading.Lock()
+        self.base_url = f"http://127.0.0.1:{self.server_address[1]}"
+
+class FakeImageRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        time.sleep(server.latency)
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != '/upload':
+            return self.send(404, b'', 'text/plain')
+        if random.random() < server.failure_rate:
+            return self.send(429, b'Too many requests', 'text/plain', {'Retry-After': '1'})
+
+        image_id = uuid.uuid4().hex[:12]
+        filename = unquote(self.headers.get('X-Filename', 'image'))
+        with server.lock:
+            server.images[image_id] = (filename, data)
+        body = json.dumps({'status': 'OK', 'url': f"{server.base_url}/page/{image_id}"}).encode()
+        self.send(200, body, 'application/json')
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        parts = self.path.strip('/').split('/')
+        with server.lock:
+            image = server.images.get(parts[1]) if len(parts) >= 2 else None
+        if image is None:
+            return self.send(404, b'', 'text/plain')
+
+        filename, data = image
+        if parts[0] == 'page':
+            direct_url = f"{server.base_url}/i/{parts[1]}/{quote(filename)}"
+            page = f'<html><head><meta property="og:image" content="{direct_url}"></head><body></body></html>'
+            return self.send(200, page.encode(), 'text/html; charset=utf-8')
+        if parts[0] == 'i':
+            return self.send(200, data, 'application/octet-stream')
+        return self.send(404, b'', 'text/plain')
+
+class FakeImageHost(ImageHost):
+    """Uploads to a FakeImageServer running in this process, for tests and offline benchmarks.
+
+    Uploads and direct link lookups are real HTTP round trips, so the whole
+    pipeline (pooling, retries, lazy resolution) is exercised without the network.
+    """
+
+    name = "fake"
+    cache_namespace = "fake"
+    persistent = False
+
+    def __init__(self, session, latency=0.0, failure_rate=0.0):
+        super().__init__()
+        self.session = session
+        self.server = FakeImageServer(latency, failure_rate)
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        print(f"🧪 Fake image host listening on {self.server.base_url}")
+
+    def upload(self, filename, fileobj):
+        try:
+            response = self.session.post(f"{self.server.base_url}/upload", data=fileobj.read(),
+                                         headers={'X-Filename': quote(filename)})
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            raise TransientUploadError(f"Network error: {e}")
+        if response.status_code == 429:
+            raise TransientUploadError("Upload failed with status code: 429", 429, get_retry_after(response))
+        if response.status_code != 200:
+            return None
+        page_url = response.json()['url']
+        direct_url = self.resolve_direct_link(page_url)
+        result = {'url': page_url}
+        if direct_url:
+            result['direct_link'] = direct_url
+        return result
+
+    def resolve_direct_link(self, page_url):
+        return extract_direct_image_url(page_url, self.session)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.session.close()
+
+IMAGE_HOSTS = ("postimages", "local", "fake")
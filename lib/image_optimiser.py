@@ -0,0 +1,91 @@
+import hashlib
+import io
+import json
+import os
+import threading
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional, optimisation is skipped without it
+    Image = None
+
+# Bump when optimise_image changes its output so derived images are rebuilt
+OPTIMISER_VERSION = 2
+
+def optimisation_available():
+    """Whether Pillow is installed so images can be optimised"""
+    return Image is not None
+
+def get_transform_params(kind, widths, retina=True, jpeg_quality=82, png_colors=256):
+    """Transform parameters for an image of the given kind ("logo", "header", "social" or "content").
+
+    Content photos are shown cropped to a square (object-fit: cover), so they are
+    scaled on their shorter side; everything else is scaled to its rendered width.
+    """
+    return {
+        "width": widths[kind],
+        "cover": kind == "content",
+        "scale": 2 if retina else 1,
+        "jpeg_quality": jpeg_quality,
+        "png_colors": png_colors,
+    }
+
+def get_variant_key(source_hash, params):
+    """Key of a derived image: the source hash combined with the transform parameters"""
+    encoded = json.dumps(params, sort_keys=True)
+    return hashlib.sha256(f"{OPTIMISER_VERSION}:{source_hash}:{encoded}".encode("utf-8")).hexdigest()
+
+def optimise_image(data, params):
+    """Resize, recompress and strip metadata from an image, returning the new bytes.
+
+    Animated GIFs and formats other than PNG/JPEG are returned unchanged, as is any
+    image the optimised version would not make smaller.
+    """
+    image = Image.open(io.BytesIO(data))
+    image_format = image.format
+    if image_format not in ("PNG", "JPEG"):
+        return data
+    # Metadata is dropped below, so apply the camera's EXIF rotation to the pixels first
+    image = ImageOps.exif_transpose(image)
+
+    target = params["width"] * params["scale"]
+    width, height = image.size
+    ratio = target / (min(width, height) if params["cover"] else width)
+    if ratio < 1:
+        image = image.resize((max(1, round(width * ratio)), max(1, round(height * ratio))), Image.LANCZOS)
+
+    output = io.BytesIO()
+    if image_format == "JPEG":
+        # Saving without exif/icc arguments drops the metadata
+        image.convert("RGB").save(output, "JPEG", quality=params["jpeg_quality"], optimize=True, progressive=True)
+    else:
+        if params["png_colors"]:
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA")
+            image = image.quantize(colors=params["png_colors"], method=Image.Quantize.FASTOCTREE)
+        image.save(output, "PNG", optimize=True)
+
+    optimised = output.getvalue()
+    return optimised if len(optimised) < len(data) else data
+
+def derive_image(source_hash, params, read_source, extension, cache_dir):
+    """Return the path of the optimised variant of an image, creating it on first use.
+
+    Variants are stored under cache_dir keyed by (source hash, transform parameters),
+    so each one is computed only once. read_source is called to get the original
+    bytes when the variant does not exist yet.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    derived_path = os.path.join(cache_dir, get_variant_key(source_hash, params) + extension.lower())
+    if os.path.exists(derived_path):
+        return derived_path
+
+    data = read_source()
+    optimised = optimise_image(data, params)
+    # Builds in other processes or threads may be deriving the same variant
+    tmp_path = f"{derived_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(optimised)
+    os.replace(tmp_path, derived_path)
+    print(f"🗜️ Optimised {len(data) / 1024:.1f} KB -> {len(optimised) / 1024:.1f} KB")
+    return derived_path
@@ -0,0 +1,127 @@
+import re
+
+# Comments, raw text elements and tags, in the order they need to be recognised
+TOKEN_PATTERN = re.compile(
+    r"(?P<comment><!--.*?-->)"
+    r"|(?P<raw><(?P<raw_tag>pre|textarea|script)\b.*?</(?P=raw_tag)\s*>)"
+    r"|(?P<style>(?P<style_open><style\b[^>]*>)(?P<css>.*?)</style\s*>)"
+    r"|(?P<tag></?(?P<tag_name>[a-zA-Z][\w:-]*)[^>]*>)",
+    re.DOTALL | re.IGNORECASE,
+)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Whitespace next to these tags never renders, so it can be dropped rather than collapsed
+BLOCK_TAGS = {
+    "html", "head", "body", "title", "meta", "link", "style", "xml", "center", "div", "p", "br", "hr",
+    "table", "thead", "tbody", "tfoot", "tr", "td", "th", "ul", "ol", "li", "h1", "h2", "h3", "h4",
+    "h5", "h6", "blockquote",
+}
+
+CSS_COMMENT_PATTERN = re.compile(r"/\*.*?\*/", re.DOTALL)
+CSS_STRING_PATTERN = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')""")
+# Quoted strings are matched first so the punctuation inside them is left alone
+CSS_SPACING_PATTERN = re.compile(CSS_STRING_PATTERN.pattern + r"""|\s*([{};,>])\s*|(:)\s+""")
+CSS_TRAILING_SEMICOLON_PATTERN = re.compile(CSS_STRING_PATTERN.pattern + r"|;(\})")
+
+def is_conditional_comment(comment):
+    """Outlook's <!--[if mso]> ... <![endif]--> and the <!--<![endif]--> closer of downlevel-revealed ones"""
+    return comment.startswith(("<!--[if", "<!--<![endif]", "<!--<!"))
+
+def split_css_rules(css):
+    """Split CSS into top-level rules, keeping block at-rules such as @media whole"""
+    rules = []
+    depth = 0
+    start = 0
+    i = 0
+    while i < len(css):
+        char = css[i]
+        if char in "\"'":
+            # Braces and semicolons inside quoted strings do not end anything
+            string = CSS_STRING_PATTERN.match(css, i)
+            if string:
+                i = string.end()
+                continue
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                rules.append(css[start:i + 1])
+                start = i + 1
+        elif char == ";" and depth == 0:
+            # Statement at-rules such as @import
+            rules.append(css[start:i + 1])
+            start = i + 1
+        i += 1
+    if css[start:].strip():
+        rules.append(css[start:])
+    return rules
+
+def minify_css(css):
+    """Drop comments and whitespace from a stylesheet and remove repeated rules.
+
+    Only the last copy of a rule that appears several times is kept, which leaves
+    the cascade unchanged.
+    """
+    css = CSS_COMMENT_PATTERN.sub("", css)
+    css = WHITESPACE_PATTERN.sub(" ", css)
+    css = CSS_SPACING_PATTERN.sub(lambda m: m.group(1) or m.group(2) or m.group(3), css).strip()
+    css = CSS_TRAILING_SEMICOLON_PATTERN.sub(lambda m: m.group(1) or m.group(2), css)
+
+    rules = [rule.strip() for rule in split_css_rules(css)]
+    last_index = {rule: i for i, rule in enumerate(rules)}
+    return "".join(rule for i, rule in enumerate(rules) if rule and last_index[rule] == i)
+
+def minify_html(html_content):
+    """Collapse whitespace and drop comments from HTML.
+
+    Conditional comments for Outlook, <pre>, <textarea> and <script> are kept as
+    they are, and <style> contents are minified with minify_css(). Whitespace next
+    to a block level tag is removed, anywhere else it becomes a single space.
+    """
+    pieces = []
+    position = 0
+    # Whether the previous token allows the whitespace after it to be dropped
+    after_block = True
+
+    def add_text(text, before_block):
+        if not text:
+            return
+        collapsed = WHITESPACE_PATTERN.sub(" ", text)
+        if after_block:
+            collapsed = collapsed.lstrip()
+        if before_block:
+            collapsed = collapsed.rstrip()
+        if collapsed:
+            pieces.append(collapsed)
+
+    for match in TOKEN_PATTERN.finditer(html_content):
+        if match.group("comment") is not None:
+            kind = "comment"
+        elif match.group("raw") is not None:
+            kind = "raw"
+        elif match.group("style") is not None:
+            kind = "style"
+        else:
+            kind = "tag"
+
+        if kind == "comment":
+            is_block = is_conditional_comment(match.group(0))
+        else:
+            is_block = kind == "style" or (kind == "tag" and match.group("tag_name").lower() in BLOCK_TAGS)
+        add_text(html_content[position:match.start()], is_block)
+        position = match.end()
+
+        if kind == "comment":
+            if is_conditional_comment(match.group(0)):
+                pieces.append(match.group(0))
+        elif kind == "style":
+            pieces.append(match.group("style_open") + minify_css(match.group("css")) + "</style>")
+        elif kind == "tag":
+            pieces.append(WHITESPACE_PATTERN.sub(" ", match.group(0)))
+        else:
+            pieces.append(match.group(0))
+        after_block = is_block
+
+    add_text(html_content[position:], True)
+    return "".join(pieces)
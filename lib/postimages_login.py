@@ -1,43 +1,82 @@
 import requests
 import os
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
 import base64
 import xml.etree.ElementTree as ET
 import time
 import random
+import re
+import html
+import json
+from requests.adapters import HTTPAdapter
+
+from lib.html_parser import find_attribute
 
 # Load environment variables from .env file
 load_dotenv()
 
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTP adapter that applies a default timeout to every request sent through it"""
+
+    def __init__(self, timeout=None, *args, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+class AuthenticationError(Exception):
+    """Raised when postimages.org rejects the session or API key"""
+
+class TransientUploadError(Exception):
+    """Raised for upload failures worth retrying: rate limiting, server errors and network errors"""
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+def get_retry_after(response):
+    """Seconds to wait from a Retry-After header, or None"""
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+def create_session(pool_size=10, timeout=(10, 60)):
+    """Create a keep-alive session with a connection pool of pool_size and default (connect, read) timeouts.
+
+    All postimages.org traffic (login, API key, uploads and direct link lookups)
+    goes through one session so connections are reused instead of reopened.
+    """
+    session = requests.Session()
+    adapter = TimeoutHTTPAdapter(timeout=timeout, pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
 def extract_csrf_token(html_content):
-    """Extract CSRF token from HTML content using BeautifulSoup"""
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
+    """Extract CSRF token from HTML content"""
     # Look for input field with name="csrf_hash"
-    csrf_input = soup.find('input', {'name': 'csrf_hash'})
-    if csrf_input and csrf_input.get('value'):
-        return csrf_input['value']
-    
-    return None
+    return find_attribute(html_content, 'input', {'name': 'csrf_hash'}, 'value') or None
 
 def extract_api_key(html_content):
-    """Extract API key from HTML content using BeautifulSoup"""
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
-    # Look for input field with id="api_key"
-    api_input = soup.find('input', {'id': 'api_key'})
-    if api_input and api_input.get('value'):
-        return api_input['value']
-    
-    # Fallback: look for input field with name="api_key"
-    api_input = soup.find('input', {'name': 'api_key'})
-    if api_input and api_input.get('value'):
-        return api_input['value']
-    
-    return None
+    """Extract API key from HTML content"""
+    # Look for input field with id="api_key", falling back to name="api_key"
+    return (find_attribute(html_content, 'input', {'id': 'api_key'}, 'value')
+            or find_attribute(html_content, 'input', {'name': 'api_key'}, 'value')
+            or None)
+
+def login_to_postimages(session=None):
+    """Log in to postimages.org, returning the authenticated session.
 
-def login_to_postimages():
+    A new pooled session is created unless one is passed in.
+    """
     # Login URL
     url = "https://postimages.org/login"
     
@@ -52,7 +91,7 @@ def login_to_postimages():
         print("   POSTIMAGES_PASSWORD=your_password")
         return None
     
-    print(f"✅ Using email: {email}")
+    print("✅ Using the POSTIMAGES_EMAIL account")
     
     # Headers to mimic a browser request
     headers = {
@@ -67,7 +106,8 @@ def login_to_postimages():
     
     try:
         # Create a session to maintain cookies
-        session = requests.Session()
+        if session is None:
+            session = create_session()
         
         # First, get the login page to establish session and extract CSRF token
         print("Getting login page...")
@@ -101,9 +141,9 @@ def login_to_postimages():
         
         if login_response.status_code == 200:
             if email in login_response.text:
-                print(f"\n✅ Login successful! Found email '{email}' in response.")
+                print("\n✅ Login successful! Found the account email in the response.")
             else:
-                print(f"\n❌ Login failed - email '{email}' not found in response.")
+                print("\n❌ Login failed - account email not found in the response.")
         else:
             print(f"\n❌ Login failed with status code: {login_response.status_code}")
             
@@ -147,22 +187,130 @@ def get_api_key(session):
             print("❌ Could not extract API key from page")
             return None
         
-        print(f"✅ API Key: {api_key}")
+        print("✅ Got the API key")
         return api_key
         
     except requests.exceptions.RequestException as e:
         print(f"Error getting API key: {e}")
         return None
 
-def upload_image(session, api_key, image_path):
-    """Upload a local image file to postimages.org using the plugin method and authenticated session."""
+def is_auth_failure(response):
+    """Whether an upload response means the session or API key is no longer valid"""
+    if response.status_code in (401, 403):
+        return True
+    # An expired session is redirected to the login page
+    if response.history and '/login' in response.url:
+        return True
+    if response.status_code == 200:
+        try:
+            result = response.json()
+        except ValueError:
+            return False
+        if isinstance(result, dict) and result.get('status') != 'OK':
+            message = json.dumps(result).lower()
+            return any(word in message for word in ('token', 'api key', 'login', 'auth'))
+    return False
+
+def load_credentials(session, cache_path, ttl_seconds):
+    """Restore cached session cookies into session and return the cached API key.
+
+    Returns None without touching the network if there is no cache, it is older than
+    ttl_seconds, or it belongs to a different POSTIMAGES_EMAIL.
+    """
+    if not cache_path or not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, 'r') as f:
+            cached = json.load(f)
+    except Exception as e:
+        print(f"Warning: Could not load credential cache: {e}")
+        return None
+
+    if cached.get('email') != os.getenv('POSTIMAGES_EMAIL'):
+        return None
+    if time.time() - cached.get('saved_at', 0) > ttl_seconds:
+        print("Cached postimages.org login has expired")
+        return None
+    if not cached.get('api_key'):
+        return None
+
+    for cookie in cached.get('cookies', []):
+        session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain', ''),
+                            path=cookie.get('path', '/'), secure=cookie.get('secure', False), expires=cookie.get('expires'))
+    return cached['api_key']
+
+def save_credentials(session, api_key, cache_path):
+    """Persist the session cookies and API key so later runs can skip logging in"""
+    if not cache_path:
+        return
+    cached = {
+        'email': os.getenv('POSTIMAGES_EMAIL'),
+        'api_key': api_key,
+        'saved_at': time.time(),
+        'cookies': [
+            {'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path, 'secure': c.secure, 'expires': c.expires}
+            for c in session.cookies
+        ],
+    }
+    directory = os.path.dirname(cache_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    try:
+        # The file holds a live login, keep it private to the current user
+        fd = os.open(cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cached, f)
+    except Exception as e:
+        print(f"Warning: Could not save credential cache: {e}")
+
+def clear_credentials(cache_path):
+    """Forget the cached login"""
+    if cache_path and os.path.exists(cache_path):
+        os.remove(cache_path)
+
+def get_authenticated_session(session=None, cache_path=None, ttl_seconds=12 * 3600, force_refresh=False):
+    """Return (session, api_key), reusing the cached login while it is within its TTL.
+
+    On the warm path no request is made at all; the cached login is only replaced
+    when it has expired, when force_refresh is set (e.g. after an AuthenticationError),
+    or when there is no cache yet. Returns (None, None) if logging in fails.
+    """
+    if session is None:
+        session = create_session()
+
+    if not force_refresh:
+        api_key = load_credentials(session, cache_path, ttl_seconds)
+        if api_key:
+            print("✅ Reusing cached postimages.org login")
+            return session, api_key
+
+    clear_credentials(cache_path)
+    session.cookies.clear()
+    session = login_to_postimages(session)
+    if not session:
+        return None, None
+    api_key = get_api_key(session)
+    if not api_key:
+        return None, None
+
+    save_credentials(session, api_key, cache_path)
+    return session, api_key
+
+def upload_image(session, api_key, image_path, fileobj=None):
+    """Upload an image to postimages.org using the plugin method and authenticated session.
+
+    If fileobj is given (e.g. a member opened from a ZIP archive) its contents are
+    streamed instead of opening image_path, which is then only used for the filename.
+    Raises AuthenticationError if the session or API key has been rejected, and
+    TransientUploadError for rate limiting, server and network errors.
+    """
     if not session:
         print("❌ Error: No authenticated session provided")
         return None
     if not api_key:
         print("❌ Error: No API key provided")
         return None
-    if not os.path.exists(image_path):
+    if fileobj is None and not os.path.exists(image_path):
         print(f"❌ Error: Image file not found: {image_path}")
         return None
 
@@ -177,14 +325,29 @@ def upload_image(session, api_key, image_path):
     }
 
     print(f"Uploading image: {image_path}")
-    with open(image_path, 'rb') as image_file:
-        files = {
-            'file': (os.path.basename(image_path), image_file, 'image/*')
-        }
-        # DO NOT set Content-Type header for multipart!
-        response = session.post(upload_url, data=upload_data, files=files)
+    try:
+        if fileobj is not None:
+            files = {
+                'file': (os.path.basename(image_path), fileobj, 'image/*')
+            }
+            # DO NOT set Content-Type header for multipart!
+            response = session.post(upload_url, data=upload_data, files=files)
+        else:
+            with open(image_path, 'rb') as image_file:
+                files = {
+                    'file': (os.path.basename(image_path), image_file, 'image/*')
+                }
+                # DO NOT set Content-Type header for multipart!
+                response = session.post(upload_url, data=upload_data, files=files)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        raise TransientUploadError(f"Network error: {e}")
 
     print(f"Upload response status: {response.status_code}")
+    if is_auth_failure(response):
+        raise AuthenticationError(f"Upload rejected with status {response.status_code}: {response.text[:200]}")
+    if response.status_code == 429 or response.status_code >= 500:
+        raise TransientUploadError(f"Upload failed with status code: {response.status_code}",
+                                   response.status_code, get_retry_after(response))
     if response.status_code == 200:
         try:
             result = response.json()
@@ -194,7 +357,7 @@ def upload_image(session, api_key, image_path):
                 image_url = result['url']
                 print(f"📁 File uploaded successfully! URL: {image_url}")
                 # Now get the direct image URL from the page
-                direct_url = extract_direct_image_url(image_url)
+                direct_url = extract_direct_image_url(image_url, session)
                 if direct_url:
                     print(f"   Direct URL: {direct_url}")
                     return {'url': image_url, 'direct_link': direct_url}
@@ -213,27 +376,47 @@ def upload_image(session, api_key, image_path):
         print(f"Response text: {response.text[:200]}")
         return None
 
-def extract_direct_image_url(image_url):
-    """Extract direct image URL from the postimages.org page"""
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        response = requests.get(image_url, headers=headers)
-        if response.status_code == 200:
-            # Look for og:image meta tag
-            soup = BeautifulSoup(response.text, 'html.parser')
-            og_image = soup.find('meta', property='og:image')
-            if og_image and og_image.get('content'):
-                return og_image['content']
-            
+OG_IMAGE_PATTERN = re.compile(r'<meta\b[^>]*\bproperty=["\']og:image["\'][^>]*>', re.IGNORECASE)
+
+def get_tag_attribute(tag, name):
+    """Return an attribute value from a single HTML start tag, or None"""
+    match = re.search(r'\b' + name + r'=(["\'])(.*?)\1', tag, re.IGNORECASE | re.DOTALL)
+    return html.unescape(match.group(2)) if match else None
+
+def find_direct_image_url(page_html):
+    """Find the direct image link on a postimages.org share page"""
+    return (find_attribute(page_html, 'meta', {'property': 'og:image'}, 'content')
             # Fallback: look for direct image link
-            direct_link = soup.find('a', {'id': 'download'})
-            if direct_link and direct_link.get('href'):
-                return direct_link['href']
-        
-        return None
+            or find_attribute(page_html, 'a', {'id': 'download'}, 'href')
+            or None)
+
+def extract_direct_image_url(image_url, session=None):
+    """Extract direct image URL from the postimages.org page.
+
+    The og:image tag is in the page head, so the page is streamed and its content is
+    returned as soon as it has been found. Pages where it cannot be read that way
+    are read to the end and parsed.
+    """
+    try:
+        if session is None:
+            session = create_session(pool_size=1)
+
+        with session.get(image_url, stream=True) as response:
+            if response.status_code != 200:
+                return None
+
+            page_html = ""
+            for chunk in response.iter_content(chunk_size=16384, decode_unicode=True):
+                if isinstance(chunk, bytes):
+                    chunk = chunk.decode(response.encoding or 'utf-8', errors='replace')
+                page_html += chunk
+                if '</head>' in page_html:
+                    match = OG_IMAGE_PATTERN.search(page_html)
+                    direct_url = get_tag_attribute(match.group(0), 'content') if match else None
+                    if direct_url:
+                        return direct_url
+
+        return find_direct_image_url(page_html)
     except Exception as e:
         print(f"Error extracting direct URL: {e}")
         return None
@@ -250,7 +433,7 @@ if __name__ == "__main__":
         api_key = get_api_key(session)
         
         if api_key:
-            print(f"\n🎉 Success! Your API key is: {api_key}")
+            print(f"\n🎉 Success! Got an API key ({api_key[:4]}...)")
             
             # Test upload with a sample image
             print("\n" + "=" * 30)
@@ -0,0 +1,136 @@
+import html
+import mimetypes
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+# Reloads the page when the server reports a new render
+LIVE_RELOAD_SCRIPT = """<script>
+new EventSource("/events").onmessage = function () { location.reload(); };
+</script>"""
+
+class PreviewServer(ThreadingHTTPServer):
+    """Local HTTP server showing a newsletter rendered in memory, with live reload.
+
+    render() returns (html, resources), where resources maps URL paths to
+    callables returning the bytes served there (images from the export). A
+    background thread calls get_state() every interval seconds and renders again
+    when its value changes; open pages are told to reload over server-sent events.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, render, get_state, interval=0.25):
+        super().__init__(address, PreviewRequestHandler)
+        self.render = render
+        self.get_state = get_state
+        self.interval = interval
+        self.version = 0
+        self.page = b""
+        self.resources = {}
+        self.changed = threading.Condition()
+        self.stopping = False
+        self.url = f"http://{self.server_address[0]}:{self.server_address[1]}/"
+
+        self._state = get_state()
+        self.refresh()
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+        self._watcher.start()
+
+    def refresh(self):
+        """Render again and tell the open pages to reload"""
+        started = time.time()
+        try:
+            page, resources = self.render()
+            print(f"🔄 Rendered in {(time.time() - started) * 1000:.0f} ms")
+        except Exception:
+            page = f"<h1>Preview failed</h1><pre>{html.escape(traceback.format_exc())}</pre>"
+            resources = self.resources
+            print("❌ Preview failed, showing the error in the browser")
+
+        # Inject the live reload script at the end of the body
+        if "</body>" in page:
+            page = page.replace("</body>", LIVE_RELOAD_SCRIPT + "</body>", 1)
+        else:
+            page += LIVE_RELOAD_SCRIPT
+
+        with self.changed:
+            self.page = page.encode("utf-8")
+            self.resources = resources
+            self.version += 1
+            self.changed.notify_all()
+
+    def _watch(self):
+        while not self.stopping:
+            time.sleep(self.interval)
+            # An error must not end the thread, or live reload stops for good
+            try:
+                state = self.get_state()
+                if state != self._state:
+                    self._state = state
+                    self.refresh()
+            except Exception as e:
+                print(f"⚠️ Watching the export failed, trying again: {e}")
+
+    def server_close(self):
+        with self.changed:
+            self.stopping = True
+            self.changed.notify_all()
+        super().server_close()
+
+class PreviewRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        path = unquote(urlsplit(self.path).path)
+        if path in ('/', '/index.html'):
+            return self.send(200, server.page, 'text/html; charset=utf-8')
+        if path == '/events':
+            return self.send_events()
+
+        read_resource = server.resources.get(path)
+        if read_resource is None:
+            return self.send(404, b'Not found', 'text/plain')
+        try:
+            body = read_resource()
+        except (OSError, KeyError):
+            return self.send(404, b'Not found', 'text/plain')
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        return self.send(200, body, content_type)
+
+    def send_events(self):
+        """Server-sent events: one "reload" message when the page changes"""
+        server = self.server
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+
+        version = server.version
+        try:
+            while True:
+                with server.changed:
+                    server.changed.wait_for(lambda: server.version != version or server.stopping, timeout=15)
+                if server.stopping:
+                    return
+                if server.version != version:
+                    self.wfile.write(b"data: reload\n\n")
+                    self.wfile.flush()
+                    return
+                # Keep the connection open through proxies and idle timeouts
+                self.wfile.write(b": keepalive\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            return
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS parsed_sections (
+    key TEXT PRIMARY KEY,
+    section TEXT NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rendered_sections (
+    key TEXT PRIMARY KEY,
+    html TEXT NOT NULL,
+    stored_at REAL NOT NULL
+);
+"""
+
+def make_key(*parts):
+    """SHA256 over everything a cached result depends on"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+class SectionCache:
+    """SQLite cache of sections, so a re-export only reprocesses the sections that changed.
+
+    Parsed sections (split, image flattening and CSS inlining done) are keyed by
+    their raw fragment of the export, and rendered sections by the exact content
+    and header image they were rendered with. Entries older than max_age_days are
+    dropped when the cache is opened.
+    """
+
+    def __init__(self, db_path, max_age_days=30):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        if max_age_days:
+            self.prune(max_age_days)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_parsed(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT section FROM parsed_sections WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_parsed(self, key, section):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO parsed_sections (key, section, stored_at) VALUES (?, ?, ?)",
+                               (key, json.dumps(section), time.time()))
+
+    def get_rendered(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT html FROM rendered_sections WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put_rendered(self, key, html_content):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO rendered_sections (key, html, stored_at) VALUES (?, ?, ?)",
+                               (key, html_content, time.time()))
+
+    def prune(self, max_age_days):
+        """Remove entries stored more than max_age_days ago, returning how many were removed"""
+        cutoff = time.time() - max_age_days * 86400
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            removed = self._conn.execute("DELETE FROM parsed_sections WHERE stored_at < ?", (cutoff,)).rowcount
+            removed += self._conn.execute("DELETE FROM rendered_sections WHERE stored_at < ?", (cutoff,)).rowcount
+        return removed
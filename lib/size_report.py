@@ -0,0 +1,23 @@
+# Gmail hides everything after the first ~102 KB of a message behind "[Message clipped]"
+GMAIL_CLIP_KB = 102
+
+def format_kb(size):
+    return f"{size / 1024:.1f} KB"
+
+def print_size_report(sizes, budget_kb=None):
+    """Print the bytes used by each part of the email ({label: bytes}, in email order).
+
+    Returns the total size in bytes.
+    """
+    total = sum(sizes.values())
+    width = max([len(label) for label in sizes] + [len("total")])
+    print("📏 Email size:")
+    for label, size in sizes.items():
+        share = size / total * 100 if total else 0
+        print(f"   {label:<{width}}  {format_kb(size):>9}  {share:4.1f}%")
+    budget = f" of {budget_kb} KB budget" if budget_kb else ""
+    print(f"   {'total':<{width}}  {format_kb(total):>9}{budget}")
+    return total
+
+def over_budget(total, budget_kb):
+    return bool(budget_kb) and total > budget_kb * 1024
@@ -0,0 +1,60 @@
+import functools
+import hashlib
+import os
+
+from jinja2 import DictLoader, Environment, FileSystemBytecodeCache, Undefined
+
+from lib.templates import start, end, html_template, social_template
+
+# end_after_social is not a Jinja template: its {{ }} placeholders are filled in by the mailer
+TEMPLATE_SOURCES = {
+    "start": start,
+    "end": end,
+    "section": html_template,
+    "social": social_template,
+}
+
+_bytecode_cache_dir = None
+_environment = None
+
+def configure(bytecode_cache_dir):
+    """Set where compiled templates are cached on disk (None to only keep them in memory)"""
+    global _bytecode_cache_dir, _environment
+    if bytecode_cache_dir != _bytecode_cache_dir:
+        _bytecode_cache_dir = bytecode_cache_dir
+        _environment = None
+
+def create_environment(bytecode_cache_dir=None):
+    """Jinja environment for the email templates.
+
+    Section content is HTML from the export, so nothing is escaped, and missing
+    values render as empty strings like they did with plain Template objects.
+    """
+    bytecode_cache = None
+    if bytecode_cache_dir:
+        os.makedirs(bytecode_cache_dir, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+
+    return Environment(
+        loader=DictLoader(TEMPLATE_SOURCES),
+        bytecode_cache=bytecode_cache,
+        autoescape=False,
+        undefined=Undefined,
+        auto_reload=False,
+    )
+
+def get_environment():
+    """The shared environment, created on first use"""
+    global _environment
+    if _environment is None:
+        _environment = create_environment(_bytecode_cache_dir)
+    return _environment
+
+def get_template(name):
+    """A compiled template from TEMPLATE_SOURCES, compiled once per process"""
+    return get_environment().get_template(name)
+
+@functools.lru_cache(maxsize=None)
+def get_template_hash(name):
+    """SHA256 of a template's source, for cache keys"""
+    return hashlib.sha256(TEMPLATE_SOURCES[name].encode("utf-8")).hexdigest()
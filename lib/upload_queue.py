@@ -0,0 +1,101 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload_queue (
+    cache_key TEXT PRIMARY KEY,
+    original_filename TEXT NOT NULL,
+    source_path TEXT NOT NULL,
+    member TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at REAL
+);
+"""
+
+def get_backoff_delay(attempt, base=1.0, maximum=60.0, retry_after=None):
+    """Exponential backoff with jitter for the given (1-based) attempt.
+
+    A Retry-After hint from the server is used as the lower bound.
+    """
+    delay = min(maximum, base * (2 ** (attempt - 1)))
+    delay = random.uniform(delay / 2, delay)
+    if retry_after:
+        delay = max(delay, min(maximum, retry_after))
+    return delay
+
+class UploadQueue:
+    """Durable queue of images waiting to be uploaded, stored next to the image cache.
+
+    Items are added before uploading starts and removed as soon as their upload has
+    been written to the image cache, so whatever is left after an interrupted or
+    failed run can be picked up again with --resume.
+    """
+
+    def __init__(self, db_path):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM upload_queue").fetchone()[0]
+
+    def enqueue(self, items):
+        """Add (cache_key, original_filename, source_path, member) items.
+
+        member is the name inside the ZIP at source_path, or None for a local file.
+        Items that are already queued keep their attempt count.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                """INSERT INTO upload_queue (cache_key, original_filename, source_path, member, status, updated_at)
+                   VALUES (?, ?, ?, ?, 'pending', ?)
+                   ON CONFLICT(cache_key) DO UPDATE SET
+                       original_filename = excluded.original_filename,
+                       source_path = excluded.source_path,
+                       member = excluded.member,
+                       status = 'pending',
+                       updated_at = excluded.updated_at""",
+                [(cache_key, original_filename, source_path, member, now)
+                 for cache_key, original_filename, source_path, member in items],
+            )
+
+    def mark_done(self, cache_key):
+        """Remove an item once its upload is in the image cache"""
+        with self._lock:
+            self._conn.execute("DELETE FROM upload_queue WHERE cache_key = ?", (cache_key,))
+
+    def mark_failed(self, cache_key, error, attempts):
+        """Record that an item ran out of retries"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE upload_queue SET status = 'failed', attempts = attempts + ?, last_error = ?, updated_at = ? WHERE cache_key = ?",
+                (attempts, str(error)[:500], time.time(), cache_key),
+            )
+
+    def items(self):
+        """All queued items as dicts, oldest first"""
+        with self._lock:
+            return [dict(row) for row in self._conn.execute("SELECT * FROM upload_queue ORDER BY updated_at")]
@@ -1,153 +1,182 @@
 import json
-from jinja2 import Template
-from lib.templates import start, end, end_after_social, html_template, social_template
-from bs4 import BeautifulSoup
+from bs4 import Tag, NavigableString, Comment
 import sys
 import os
-import shutil
+import argparse
+import contextlib
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from collections import namedtuple
+import glob
+import io
+import ipaddress
+import base64
+import mimetypes
+import pathlib
+from urllib.parse import quote
 import zipfile
-from config import social_data, image_mappings
+from config import (social_data, image_mappings, upload_workers, image_cache_path, legacy_image_cache_path, asset_manifest_path,
+                    optimise_images, optimise_retina, optimise_widths, optimise_jpeg_quality, optimise_png_colors, derived_image_dir,
+                    http_pool_size, http_connect_timeout, http_read_timeout, credential_cache_path, credential_ttl_hours,
+                    upload_max_attempts, upload_backoff_base, upload_backoff_max,
+                    image_host, local_host_root, local_host_base_url, fake_host_latency, fake_host_failure_rate,
+                    html_parser_backend, jinja_cache_dir, frame_cache_dir,
+                    inline_css_properties, house_styles, house_attributes, minify_output, size_budget_kb,
+                    section_cache_path, section_cache_max_age_days, batch_jobs, watch_interval, preview_port,
+                    draft_images, draft_thumbnail_width, draft_data_uri_max_kb, draft_image_dir,
+                    service_port, service_jobs, service_upload_dir, service_max_upload_mb)
 import re
 import datetime
-from lib.postimages_login import login_to_postimages, get_api_key, upload_image
+from lib.postimages_login import create_session, AuthenticationError, TransientUploadError
+from lib.image_hosts import IMAGE_HOSTS, PostImagesHost, LocalDirectoryHost, FakeImageHost
+from lib.upload_queue import UploadQueue, get_backoff_delay
+from lib.image_cache import ImageCache
+from lib.asset_manifest import load_asset_manifest, lookup_asset, make_asset_entry, save_asset_manifest
+from lib.html_parser import configure as configure_html_parser, make_soup, get_text, get_tree_builder
+from lib.template_env import configure as configure_templates, get_template, get_template_hash
+from lib.section_cache import SectionCache, make_key
+from lib.email_frame import load_frame, generate_frame
+from lib.css_inliner import get_inliner
+from lib.minifier import minify_html
+from lib.preview_server import PreviewServer
+from lib.build_service import BuildService
+from lib.size_report import GMAIL_CLIP_KB, format_kb, print_size_report, over_budget
+from lib.image_optimiser import optimisation_available, get_transform_params, get_variant_key, derive_image
 import hashlib
-import string
-import random
 
-def load_image_cache():
-    """Load the image upload cache from file"""
-    cache_file = 'image_cache.json'
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Warning: Could not load cache file: {e}")
-    return {}
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
 
-def save_image_cache(cache):
-    """Save the image upload cache to file"""
-    cache_file = 'image_cache.json'
-    try:
-        with open(cache_file, 'w') as f:
-            json.dump(cache, f, indent=2)
-    except Exception as e:
-        print(f"Warning: Could not save cache file: {e}")
+def get_stream_hash(stream):
+    """Calculate SHA256 hash of a binary stream"""
+    hash_sha256 = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(65536), b""):
+        hash_sha256.update(chunk)
+    return hash_sha256.hexdigest()
 
 def get_file_hash(file_path):
     """Calculate SHA256 hash of a file"""
-    hash_sha256 = hashlib.sha256()
     with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_sha256.update(chunk)
-    return hash_sha256.hexdigest()
+        return get_stream_hash(f)
 
-def generate_random_string(length=6):
-    """Generate a random string of specified length"""
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
+def get_asset_hash(file_path, image_cache):
+    """SHA256 hash of a local asset, reusing the memoised hash while its size, mtime and inode are unchanged"""
+    stat_result = os.stat(file_path)
+    file_hash = image_cache.get_memoised_hash(file_path, stat_result)
+    if file_hash is None:
+        file_hash = get_file_hash(file_path)
+        image_cache.memoise_hash(file_path, stat_result, file_hash)
+    return file_hash
 
-def cleanup_temp_directory(tmp_dir):
-    """Clean up temporary directory with retry logic for Windows and Google Drive"""
-    import time
-    
-    for attempt in range(5):  # Try up to 5 times for Google Drive
-        try:
-            if os.path.exists(tmp_dir):
-                # Force remove read-only files on Windows
-                for root, dirs, files in os.walk(tmp_dir, topdown=False):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        try:
-                            os.chmod(file_path, 0o777)  # Make file writable
-                        except:
-                            pass
-                    for dir in dirs:
-                        dir_path = os.path.join(root, dir)
-                        try:
-                            os.chmod(dir_path, 0o777)  # Make directory writable
-                        except:
-                            pass
-                
-                # Try to remove the directory
-                shutil.rmtree(tmp_dir, ignore_errors=True)
-                
-                # Check if directory still exists
-                if not os.path.exists(tmp_dir):
-                    print(f"✅ Cleaned up temporary directory: {tmp_dir}")
-                    return True
-                else:
-                    # If directory still exists, try to remove individual files
-                    print(f"⚠️ Directory still exists, trying individual file removal...")
-                    for root, dirs, files in os.walk(tmp_dir, topdown=False):
-                        for file in files:
-                            try:
-                                os.remove(os.path.join(root, file))
-                            except:
-                                pass
-                        for dir in dirs:
-                            try:
-                                os.rmdir(os.path.join(root, dir))
-                            except:
-                                pass
-                    # Final attempt to remove the directory
-                    try:
-                        os.rmdir(tmp_dir)
-                        print(f"✅ Cleaned up temporary directory: {tmp_dir}")
-                        return True
-                    except:
-                        pass
-                        
-        except Exception as e:
-            if attempt < 4:  # Not the last attempt
-                print(f"⚠️ Cleanup attempt {attempt + 1} failed, retrying in 2 seconds... ({e})")
-                time.sleep(2)  # Wait longer for Google Drive sync
-            else:
-                print(f"❌ Failed to clean up temporary directory {tmp_dir} after 5 attempts: {e}")
-                print(f"💡 You may need to manually delete: {tmp_dir}")
-                return False
-    return False
+class ArchiveMember(namedtuple("ArchiveMember", "zip_path member")):
+    """An image inside a ZIP that is not open, for uploads gathered from several archives"""
 
-def main():
-    zip_path = sys.argv[1]
-    tmp_dir = f'./tmp_{generate_random_string(6)}'
-    html_file_path = None
+def open_image_source(source, zip_ref=None):
+    """Open an image source for reading: a ZipInfo member of zip_ref, an ArchiveMember or a local file path"""
+    if isinstance(source, zipfile.ZipInfo):
+        return zip_ref.open(source)
+    if isinstance(source, ArchiveMember):
+        # The member stays readable after the archive itself is closed
+        with zipfile.ZipFile(source.zip_path) as archive:
+            return archive.open(source.member)
+    return open(source, 'rb')
 
-    os.makedirs(tmp_dir, exist_ok=True)
-    print(f"Created temporary directory: {tmp_dir}")
+def read_image_source(source, zip_ref=None):
+    """Read the full contents of an image source"""
+    with open_image_source(source, zip_ref) as image_file:
+        return image_file.read()
 
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(tmp_dir)
-        
-    images_list = []
-     
-    for root, dirs, files in os.walk(tmp_dir):
-        for file in files:
-            if file.lower().endswith('.html'):
-                html_file_path = os.path.join(root, file)
-            elif file.lower().endswith('.png') or file.lower().endswith('.jpg') or file.lower().endswith('.jpeg') or file.lower().endswith('.gif'):
-                images_list.append(os.path.join(root, file))
-    
-    # Load image cache
-    print("=" * 50)
-    print("Loading image cache...")
-    image_cache = load_image_cache()
-    print(f"Cache loaded with {len(image_cache)} entries")
-    
-    # Upload images to postimages.org
-    print("=" * 50)
-    print("Processing images for upload")
-    print("=" * 50)
-    
-    # Check cache first, then upload if needed
-    image_upload_mapping = {}
-    images_to_upload = []
-    
-    # Add config images to the upload list
+def get_source_size(source):
+    """Size in bytes of an image source"""
+    if isinstance(source, zipfile.ZipInfo):
+        return source.file_size
+    if isinstance(source, ArchiveMember):
+        with zipfile.ZipFile(source.zip_path) as archive:
+            return archive.getinfo(source.member).file_size
+    return os.path.getsize(source)
+
+def get_source_name(source):
+    """Human readable name of an image source"""
+    if isinstance(source, zipfile.ZipInfo):
+        return source.filename
+    if isinstance(source, ArchiveMember):
+        return source.member
+    return source
+
+def read_zip_contents(zip_ref):
+    """Find the HTML document and image members in the archive without extracting it.
+
+    Returns (html_content, image_members) where html_content is the decoded HTML
+    document and image_members is a list of ZipInfo entries for the images.
+    """
+    html_content = None
+    image_members = []
+    for info in zip_ref.infolist():
+        if info.is_dir():
+            continue
+        name = info.filename.lower()
+        if name.endswith('.html'):
+            html_content = zip_ref.read(info).decode('utf-8')
+        elif name.endswith(IMAGE_EXTENSIONS):
+            image_members.append(info)
+    return html_content, image_members
+
+def get_image_kind(original_filename):
+    """Which rendered slot an image fills: logo, header, social or content"""
+    if original_filename == "config_logo":
+        return "logo"
+    if original_filename.startswith("config_social_"):
+        return "social"
+    if original_filename.startswith("config_"):
+        return "header"
+    return "content"
+
+def get_image_transform(original_filename, optimise, retina=True):
+    """Optimisation parameters for an image, or None when optimisation is off"""
+    if not optimise:
+        return None
+    return get_transform_params(get_image_kind(original_filename), optimise_widths, retina,
+                                optimise_jpeg_quality, optimise_png_colors)
+
+def get_cache_key(file_hash, transform, host=None):
+    """Image cache key: the source hash, or the optimised variant's key when transformed,
+    prefixed with the host's namespace for hosts other than postimages.org"""
+    cache_key = get_variant_key(file_hash, transform) if transform else file_hash
+    if host is not None and host.cache_namespace:
+        cache_key = f"{host.cache_namespace}:{cache_key}"
+    return cache_key
+
+def is_host_cache_key(host, cache_key):
+    """Whether an image cache key is in the host's namespace (postimages.org's keys have none)"""
+    namespace, separator, key = cache_key.rpartition(":")
+    return (namespace or None) == (host.cache_namespace or None)
+
+def get_upload_source(source, file_hash, transform, zip_ref=None):
+    """The source to upload for an image: its optimised variant when transformed, else the source itself"""
+    if not transform:
+        return source
+    extension = os.path.splitext(get_source_name(source))[1]
+    return derive_image(file_hash, transform, lambda: read_image_source(source, zip_ref), extension, derived_image_dir)
+
+def resolve_optimise(optimise):
+    """Whether to optimise images, warning when it is requested but Pillow is missing"""
+    if optimise and not optimisation_available():
+        print("⚠️ Image optimisation needs Pillow (pip install Pillow), uploading originals")
+        return False
+    return optimise
+
+def collect_config_images(positions=None):
+    """List the (path, mapping key) pairs of header images and social icons from config.
+
+    If positions is given, only the header images for those positions are included.
+    """
     config_images = []
     
     # Add header images from config
     for position, image_path in image_mappings.items():
+        if positions is not None and position not in positions:
+            continue
         if os.path.exists(image_path):
             config_images.append((image_path, f"config_{position}"))
     
@@ -156,66 +185,1068 @@ def main():
         if os.path.exists(social["social_image"]):
             config_images.append((social["social_image"], f"config_social_{os.path.basename(social['social_image'])}"))
     
+    return config_images
+
+def create_http_session(workers=1):
+    """Pooled keep-alive session for all image host traffic, with room for every worker"""
+    return create_session(max(http_pool_size, workers), (http_connect_timeout, http_read_timeout))
+
+def create_image_host(name, workers=1):
+    """Create the image host backend with the given name"""
+    if name == "local":
+        return LocalDirectoryHost(local_host_root, local_host_base_url)
+    if name == "fake":
+        return FakeImageHost(create_http_session(workers), fake_host_latency, fake_host_failure_rate)
+    return PostImagesHost(create_http_session(workers), credential_cache_path, credential_ttl_hours * 3600)
+
+def open_image_cache(host):
+    """Open the image cache for a host; hosts whose URLs do not outlive the process get a throwaway one"""
+    if host.persistent:
+        return ImageCache(image_cache_path, legacy_image_cache_path), UploadQueue(image_cache_path)
+    return ImageCache(":memory:"), UploadQueue(":memory:")
+
+def open_section_cache(enabled=True):
+    """Open the section cache, or return None when it is disabled"""
+    if not enabled or not section_cache_path:
+        return None
+    return SectionCache(section_cache_path, section_cache_max_age_days)
+
+def authenticate_host(host):
+    """Get the host ready for uploads, raising BuildError if it cannot be.
+
+    postimages.org reuses a cached login younger than credential_ttl_hours without any requests.
+    """
+    if not host.authenticate():
+        raise BuildError(f"Could not log in to {host.name}, the images are queued for --resume")
+
+def submit_in_context(executor, fn, *args):
+    """Submit fn to a worker thread that runs with a copy of the caller's context variables,
+    so what it prints goes where the caller's output goes (see JobOutput)"""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+def upload_images(host, images_to_upload, workers=1, zip_ref=None, image_cache=None, upload_queue=None):
+    """Upload images to an authenticated image host using a bounded pool of worker threads.
+
+    Each entry of images_to_upload is (source, original_filename, file_hash), where
+    source is a local file path or a ZipInfo member of zip_ref that is streamed
+    straight from the archive. If image_cache is given, each upload is recorded in
+    it as soon as it completes, and the item is then removed from upload_queue.
+
+    Rate limiting, server and network errors are retried up to upload_max_attempts
+    times with exponential backoff and jitter; a 429 pauses every worker. If the
+    login is rejected mid-run it is refreshed once (by the first worker to notice)
+    and the upload retried with the new API key.
+
+    Returns (uploaded, pending): uploaded is a list of (original_filename, file_hash,
+    uploaded_url) tuples in the same order as images_to_upload, and pending is a list
+    of (original_filename, file_hash, page_url) tuples for images that uploaded but
+    whose direct link could not be read yet (see resolve_direct_links()).
+    """
+    # A URL from one host must never be cached under another host's key
+    foreign = [original_filename for source, original_filename, file_hash in images_to_upload
+               if not is_host_cache_key(host, file_hash)]
+    if foreign:
+        raise BuildError(f"Not uploading to {host.name}, these images were planned for another host: {', '.join(foreign)}")
+
+    total = len(images_to_upload)
+    workers = max(1, min(workers, total))
+    results = [None] * total
+    pending = []
+    done = 0
+    progress_lock = threading.Lock()
+    rate_limit = {"until": 0.0}
+
+    def upload_one(source):
+        """Upload one image with retries, returning (upload_result or None, attempts made).
+
+        An exception that ends the retries gets the number of attempts made as its attempts attribute.
+        """
+        name = os.path.basename(get_source_name(source))
+        refreshed = False
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                # Wait out a rate limit hit by any worker
+                pause = rate_limit["until"] - time.time()
+                if pause > 0:
+                    time.sleep(pause)
+                generation = host.auth_generation
+                try:
+                    with open_image_source(source, zip_ref) as image_file:
+                        upload_result = host.upload(name, image_file)
+                    break
+                except AuthenticationError:
+                    if refreshed or not host.authenticate(force_refresh=True, stale_generation=generation):
+                        raise
+                    refreshed = True
+                except TransientUploadError as e:
+                    if attempt >= upload_max_attempts:
+                        raise
+                    delay = get_backoff_delay(attempt, upload_backoff_base, upload_backoff_max, e.retry_after)
+                    if e.status_code == 429:
+                        rate_limit["until"] = max(rate_limit["until"], time.time() + delay)
+                    print(f"⚠️ {name}: {e}, retrying in {delay:.1f}s (attempt {attempt}/{upload_max_attempts})")
+                    time.sleep(delay)
+        except Exception as e:
+            e.attempts = attempt
+            raise
+        if upload_result and upload_result.get('url'):
+            return upload_result, attempt
+        return None, attempt
+
+    print(f"Using {workers} upload worker{'s' if workers != 1 else ''}")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            submit_in_context(executor, upload_one, source): index
+            for index, (source, original_filename, file_hash) in enumerate(images_to_upload)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            source, original_filename, file_hash = images_to_upload[index]
+            image_path = get_source_name(source)
+            error = "upload rejected"
+            try:
+                upload_result, attempts = future.result()
+            except Exception as e:
+                print(f"❌ Error uploading {image_path}: {e}")
+                upload_result = None
+                attempts = getattr(e, "attempts", 1)
+                error = e
+
+            with progress_lock:
+                done += 1
+                if upload_result:
+                    uploaded_url = upload_result.get('direct_link')
+                    page_url = upload_result['url']
+                    # Cache the page URL even without a direct link so the image is never uploaded twice
+                    if image_cache is not None:
+                        image_cache.put(file_hash, uploaded_url, page_url, get_source_size(source))
+                        if upload_queue is not None:
+                            upload_queue.mark_done(file_hash)
+                    if uploaded_url:
+                        results[index] = (original_filename, file_hash, uploaded_url)
+                        print(f"[{done}/{total}] ✅ Uploaded: {original_filename} -> {uploaded_url}")
+                    else:
+                        pending.append((original_filename, file_hash, page_url))
+                        print(f"[{done}/{total}] ⏳ Uploaded, direct link pending: {original_filename} -> {page_url}")
+                else:
+                    if upload_queue is not None:
+                        upload_queue.mark_failed(file_hash, error, attempts)
+                    print(f"[{done}/{total}] ❌ Failed to upload: {image_path}")
+
+    return [result for result in results if result], pending
+
+def get_queue_item(source, original_filename, cache_key, zip_path=None):
+    """Describe an upload as a (cache_key, original_filename, source_path, member) queue item"""
+    if isinstance(source, zipfile.ZipInfo):
+        return (cache_key, original_filename, os.path.abspath(zip_path), source.filename)
+    if isinstance(source, ArchiveMember):
+        return (cache_key, original_filename, os.path.abspath(source.zip_path), source.member)
+    return (cache_key, original_filename, os.path.abspath(source), None)
+
+def get_queue_source(item):
+    """The upload source of a (cache_key, original_filename, source_path, member) queue item"""
+    cache_key, original_filename, source_path, member = item
+    return ArchiveMember(source_path, member) if member else source_path
+
+def get_resumable_uploads(upload_queue, image_cache, zip_ref, zip_path, host):
+    """Turn the items left in the upload queue by a previous run back into uploads to host.
+
+    Items queued for another image host or from other ZIP files are left in the
+    queue for a later run. Items whose source has disappeared and items that have
+    been uploaded in the meantime are dropped from the queue.
+    """
+    resumable = []
+    for item in upload_queue.items():
+        if not is_host_cache_key(host, item["cache_key"]):
+            print(f"⏭️ Queued upload is for another image host, skipping: {item['original_filename']}")
+            continue
+        if image_cache.get_entry(item["cache_key"]):
+            upload_queue.mark_done(item["cache_key"])
+            continue
+        if item["member"]:
+            if item["source_path"] != os.path.abspath(zip_path):
+                print(f"⏭️ Queued upload belongs to {item['source_path']}, skipping: {item['member']}")
+                continue
+            try:
+                source = zip_ref.getinfo(item["member"])
+            except KeyError:
+                source = None
+        else:
+            source = item["source_path"] if os.path.exists(item["source_path"]) else None
+        if source is None:
+            print(f"⚠️ Queued image no longer exists, dropping: {item['original_filename']}")
+            upload_queue.mark_done(item["cache_key"])
+            continue
+        resumable.append((source, item["original_filename"], item["cache_key"]))
+    return resumable
+
+def resolve_direct_links(host, pending, workers=1, image_cache=None):
+    """Look up the direct image URLs of uploaded images from their share pages in one parallel batch.
+
+    pending is a list of (original_filename, file_hash, page_url) tuples. Each
+    hash is looked up once, and its link goes to every filename sharing it.
+    Resolved links are written to image_cache. Returns a list of (original_filename,
+    file_hash, direct_url) tuples for the links that were found.
+    """
+    if not pending:
+        return []
+
+    # Identical images share a cache key: resolve it once for all of their filenames
+    page_urls = {}
+    filenames = {}
+    for original_filename, file_hash, page_url in pending:
+        page_urls.setdefault(file_hash, page_url)
+        names = filenames.setdefault(file_hash, [])
+        if original_filename not in names:
+            names.append(original_filename)
+
+    print(f"\nResolving {len(page_urls)} pending direct links...")
+    resolved = []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(page_urls)))) as executor:
+        futures = {
+            submit_in_context(executor, host.resolve_direct_link, page_url): file_hash
+            for file_hash, page_url in page_urls.items()
+        }
+        for future in as_completed(futures):
+            file_hash = futures[future]
+            names = ", ".join(filenames[file_hash])
+            direct_url = future.result()
+            if direct_url:
+                if image_cache is not None:
+                    image_cache.set_url(file_hash, direct_url)
+                resolved.extend((original_filename, file_hash, direct_url) for original_filename in filenames[file_hash])
+                print(f"✅ Resolved: {names} -> {direct_url}")
+            else:
+                print(f"❌ Direct link still unavailable for {names} ({page_urls[file_hash]}), will retry next run")
+    return resolved
+
+def add_upload_arguments(parser):
+    """Add the upload flags shared by the build and manifest commands"""
+    parser.add_argument("-w", "--workers", type=int, default=upload_workers,
+                        help=f"Number of parallel image uploads (default: {upload_workers})")
+    parser.add_argument("--host", choices=IMAGE_HOSTS, default=image_host,
+                        help=f"Where to host images (default: {image_host})")
+    parser.add_argument("--optimise", action=argparse.BooleanOptionalAction, default=optimise_images,
+                        help="Resize and recompress images to their rendered size before uploading (needs Pillow)")
+    parser.add_argument("--retina", action=argparse.BooleanOptionalAction, default=optimise_retina,
+                        help="Keep optimised images at 2x their rendered size for high-DPI screens")
+
+def add_output_arguments(parser):
+    """Add the flags that control the generated email"""
+    parser.add_argument("--minify", action=argparse.BooleanOptionalAction, default=minify_output,
+                        help="Strip whitespace and comments from the email (Outlook conditional comments are kept)")
+    parser.add_argument("--section-cache", action=argparse.BooleanOptionalAction, default=True,
+                        help="Reuse parsed and rendered sections that have not changed since an earlier build")
+    parser.add_argument("--size-budget", type=float, default=size_budget_kb, metavar="KB",
+                        help=f"Fail when the email is larger than this (default: {size_budget_kb}, 0 to disable)")
+
+DRAFT_IMAGE_MODES = ("file", "data")
+
+COMMANDS = ('build', 'batch', 'preview', 'serve', 'cache', 'manifest')
+
+def parse_args(argv=None):
+    """Parse command line arguments.
+
+    The build command is the default, so `python main.py newsletter.zip` still works.
+    """
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv and argv[0] not in COMMANDS and argv[0] not in ('-h', '--help'):
+        argv.insert(0, 'build')
+
+    parser = argparse.ArgumentParser(description="Generate the MPS newsletter email from a Google Docs ZIP export")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Generate the newsletter from a ZIP export (default)")
+    build_parser.add_argument("zip_path", nargs="?", help="Path to the exported newsletter ZIP file")
+    build_parser.add_argument("--watch", action="store_true",
+                              help="Keep running and rebuild whenever the ZIP changes; the path may also be "
+                                   "a drop folder, whose newest ZIP is built")
+    build_parser.add_argument("--resume", action="store_true",
+                              help="Retry the uploads left over from an interrupted or failed run first "
+                                   "(the ZIP defaults to the one that run used)")
+    build_parser.add_argument("--draft", action="store_true",
+                              help="Build a proofreading draft with offline images, without contacting the image host")
+    build_parser.add_argument("--draft-images", choices=DRAFT_IMAGE_MODES, default=draft_images,
+                              help=f"How drafts show images: file:// links or inlined thumbnails (default: {draft_images})")
+    build_parser.add_argument("--publish", metavar="DRAFT",
+                              help="Turn a draft into the final email, uploading its images and swapping in hosted URLs")
+    add_upload_arguments(build_parser)
+    add_output_arguments(build_parser)
+    build_parser.set_defaults(issue_name=None)
+
+    batch_parser = subparsers.add_parser("batch", help="Generate many newsletters at once, sharing image uploads")
+    batch_parser.add_argument("paths", nargs="+", help="ZIP files, directories of ZIP files or glob patterns")
+    batch_parser.add_argument("-j", "--jobs", type=int, default=batch_jobs,
+                              help="Number of issues processed in parallel (default: one per CPU)")
+    add_upload_arguments(batch_parser)
+    add_output_arguments(batch_parser)
+
+    preview_parser = subparsers.add_parser("preview", help="Serve a live preview of an export without uploading anything")
+    preview_parser.add_argument("path", help="Exported newsletter ZIP file or unzipped export directory")
+    preview_parser.add_argument("--port", type=int, default=preview_port, help=f"Port to serve on (default: {preview_port})")
+    preview_parser.add_argument("--bind", default="127.0.0.1", help="Address to serve on (default: 127.0.0.1)")
+    preview_parser.add_argument("--section-cache", action=argparse.BooleanOptionalAction, default=True,
+                                help="Reuse parsed and rendered sections that have not changed")
+
+    serve_parser = subparsers.add_parser("serve", help="Run a web service that builds uploaded exports")
+    serve_parser.add_argument("--port", type=int, default=service_port, help=f"Port to serve on (default: {service_port})")
+    serve_parser.add_argument("--bind", default="127.0.0.1",
+                              help="Address to serve on (default: 127.0.0.1). The service has no access control, "
+                                   "so keep it on localhost")
+    serve_parser.add_argument("-j", "--jobs", type=int, default=service_jobs,
+                              help=f"Number of builds run at once (default: {service_jobs})")
+    add_upload_arguments(serve_parser)
+    add_output_arguments(serve_parser)
+    serve_parser.set_defaults(resume=False)
+
+    cache_parser = subparsers.add_parser("cache", help="Inspect and maintain the image cache")
+    cache_subparsers = cache_parser.add_subparsers(dest="cache_command", required=True)
+    cache_subparsers.add_parser("stats", help="Show the number of cached images")
+    import_parser = cache_subparsers.add_parser("import", help="Import a legacy image_cache.json file")
+    import_parser.add_argument("json_path", nargs="?", default=legacy_image_cache_path,
+                               help=f"Path to the JSON cache (default: {legacy_image_cache_path})")
+    prune_parser = cache_subparsers.add_parser("prune", help="Evict stale or dead entries")
+    prune_parser.add_argument("--older-than", type=float, metavar="DAYS",
+                              help="Remove entries not uploaded, used by a build or verified in the last DAYS days")
+    prune_parser.add_argument("--check-urls", action="store_true",
+                              help="Check every cached URL and remove the ones that no longer load")
+
+    manifest_parser = subparsers.add_parser("manifest", help="Precompute hashes and hosted URLs of the config assets")
+    manifest_parser.add_argument("-o", "--output", default=asset_manifest_path,
+                                 help=f"Where to write the manifest (default: {asset_manifest_path})")
+    add_upload_arguments(manifest_parser)
+
+    args = parser.parse_args(argv)
+    if args.command == "build" and not args.zip_path and not args.resume and not args.publish:
+        parser.error("the ZIP file is required unless --resume or --publish is given")
+    if args.command == "build" and args.publish and (args.zip_path or args.draft or args.watch or args.resume):
+        parser.error("--publish takes the draft to publish instead of a ZIP file")
+    if args.command == "build" and args.draft and (args.watch or args.resume):
+        parser.error("--draft cannot be combined with --watch or --resume (use the preview command to follow edits)")
+    if args.command == "build" and args.watch and not args.zip_path:
+        parser.error("--watch needs a ZIP file or drop folder to watch")
+    if args.command in ("build", "batch", "serve", "manifest") and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.command in ("batch", "serve") and args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.command == "cache" and args.cache_command == "prune" and args.older_than is None and not args.check_urls:
+        parser.error("cache prune needs --older-than and/or --check-urls")
+    return args
+
+def cache_command(args):
+    """Run an image cache maintenance command"""
+    with ImageCache(image_cache_path) as image_cache:
+        if args.cache_command == "stats":
+            entries = image_cache.entries()
+            total_size = sum(entry["size"] or 0 for entry in entries)
+            print(f"{image_cache_path}: {len(entries)} entries, {total_size / 1024:.1f} KB of images")
+        elif args.cache_command == "import":
+            if not os.path.exists(args.json_path):
+                print(f"❌ Cache file not found: {args.json_path}")
+                return
+            imported = image_cache.import_json(args.json_path)
+            print(f"✅ Imported {imported} entries from {args.json_path}")
+        elif args.cache_command == "prune":
+            removed = image_cache.prune(args.older_than, args.check_urls)
+            print(f"✅ Removed {removed} entries, {len(image_cache)} remaining")
+
+def manifest_command(args):
+    """Write the asset manifest (path -> hash -> hosted URL) for the header images and social icons,
+    uploading any asset that is not in the image cache yet"""
+    optimise = resolve_optimise(args.optimise)
+    host = create_image_host(args.host, args.workers)
+    image_cache, upload_queue = open_image_cache(host)
+    with host_closing(host), image_cache, upload_queue:
+        assets = []
+        to_upload = []
+        pending = []
+        for image_path, config_key in collect_config_images():
+            file_hash = get_asset_hash(image_path, image_cache)
+            transform = get_image_transform(config_key, optimise, args.retina)
+            cache_key = get_cache_key(file_hash, transform, host)
+            assets.append((image_path, file_hash, transform, cache_key))
+            cache_entry = image_cache.get_entry(cache_key)
+            if cache_entry and not cache_entry["url"] and cache_entry["page_url"]:
+                pending.append((config_key, cache_key, cache_entry["page_url"]))
+            elif not cache_entry or not cache_entry["url"]:
+                to_upload.append((get_upload_source(image_path, file_hash, transform), config_key, cache_key))
+
+        if to_upload:
+            print(f"Uploading {len(to_upload)} assets missing from the image cache...")
+            authenticate_host(host)
+            uploaded, upload_pending = upload_images(host, to_upload, args.workers, image_cache=image_cache)
+            pending.extend(upload_pending)
+        resolve_direct_links(host, pending, args.workers, image_cache)
+
+        manifest = {}
+        for image_path, file_hash, transform, cache_key in assets:
+            url = image_cache.get(cache_key)
+            if not url:
+                print(f"⚠️ No hosted URL for {image_path}, leaving it out of the manifest")
+                continue
+            manifest[os.path.normpath(image_path)] = make_asset_entry(image_path, file_hash, url, transform, host.name)
+
+    save_asset_manifest(args.output, manifest)
+    print(f"✅ Wrote {len(manifest)} assets to {args.output}")
+
+class BuildError(Exception):
+    """Raised when a newsletter cannot be generated correctly"""
+
+@contextlib.contextmanager
+def host_closing(host):
+    """Close an image host (and stop any server it runs) when the block exits"""
+    try:
+        yield host
+    finally:
+        host.close()
+
+def main():
+    args = parse_args()
+    try:
+        try:
+            configure_html_parser(html_parser_backend)
+        except ValueError as e:
+            raise BuildError(str(e))
+        configure_templates(jinja_cache_dir)
+
+        if args.command == "cache":
+            cache_command(args)
+        elif args.command == "manifest":
+            manifest_command(args)
+        elif args.command == "batch":
+            batch(args)
+        elif args.command == "preview":
+            preview(args)
+        elif args.command == "serve":
+            serve(args)
+        else:
+            build(args)
+    except BuildError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+def build(args):
+    if args.publish:
+        return publish(args)
+    if args.draft:
+        # Drafts never create an image host, so nothing can reach the network
+        with open_section_cache(args.section_cache) or contextlib.nullcontext() as section_cache:
+            return build_draft(args, args.zip_path, section_cache)
+
+    zip_path = args.zip_path
+    workers = args.workers
+    optimise = resolve_optimise(args.optimise)
+    host = create_image_host(args.host, workers)
+    image_cache, upload_queue = open_image_cache(host)
+    section_cache = open_section_cache(args.section_cache)
+
+    with host_closing(host), image_cache, upload_queue, section_cache or contextlib.nullcontext():
+        if args.watch:
+            return watch(args, zip_path, host, image_cache, upload_queue, workers, optimise, section_cache)
+        if not zip_path:
+            zip_path = image_cache.get_meta("last_build_zip")
+            if not zip_path or not os.path.exists(zip_path):
+                raise BuildError("No ZIP file given and the previous run's ZIP could not be found")
+            print(f"Resuming the previous run of {zip_path}")
+        image_cache.set_meta("last_build_zip", os.path.abspath(zip_path))
+        
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            return build_from_zip(args, zip_path, zip_ref, host, image_cache, upload_queue, workers, optimise, section_cache)
+
+def find_watched_zip(watch_path):
+    """The ZIP to build: the watched file itself, or the newest ZIP in a watched drop folder"""
+    if not os.path.isdir(watch_path):
+        return watch_path
+    zip_paths = glob.glob(os.path.join(watch_path, "*.zip"))
+    return max(zip_paths, key=os.path.getmtime) if zip_paths else None
+
+def get_file_state(path):
+    """(path, size, mtime) of a file, or None if it does not exist"""
+    try:
+        stat_result = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return (path, stat_result.st_size, stat_result.st_mtime_ns)
+
+def watch(args, watch_path, host, image_cache, upload_queue, workers, optimise, section_cache=None):
+    """Rebuild whenever the ZIP (or the newest ZIP in a drop folder) changes, until interrupted.
+
+    The host session, caches and compiled templates stay loaded between builds,
+    so a rebuild only pays for what changed in the export.
+    """
+    print(f"👀 Watching {watch_path} for new exports (Ctrl+C to stop)")
+    last_state = None
+    try:
+        while True:
+            zip_path = find_watched_zip(watch_path)
+            state = get_file_state(zip_path)
+            if state and state != last_state:
+                # Only build once the export has finished being written
+                time.sleep(watch_interval)
+                if get_file_state(zip_path) != state:
+                    continue
+                last_state = state
+
+                started = time.time()
+                image_cache.set_meta("last_build_zip", os.path.abspath(zip_path))
+                try:
+                    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                        build_from_zip(args, zip_path, zip_ref, host, image_cache, upload_queue, workers, optimise, section_cache)
+                    print(f"⚡ Rebuilt {os.path.basename(zip_path)} in {time.time() - started:.2f}s")
+                except (BuildError, zipfile.BadZipFile) as e:
+                    print(f"❌ {e}")
+                # Queued uploads are only resumed by the first build
+                args.resume = False
+                print(f"👀 Waiting for changes to {watch_path}...")
+            time.sleep(watch_interval)
+    except KeyboardInterrupt:
+        print("\nStopped watching")
+
+def read_export(path):
+    """Read a newsletter export: a ZIP file or an unzipped export directory.
+
+    Returns (html_content, images), where images maps image file names to sources
+    for open_image_source(). Images are not read until they are needed.
+    """
+    if os.path.isdir(path):
+        html_content = None
+        images = {}
+        for directory, dirnames, filenames in os.walk(path):
+            for filename in sorted(filenames):
+                file_path = os.path.join(directory, filename)
+                if filename.lower().endswith('.html') and html_content is None:
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        html_content = f.read()
+                elif filename.lower().endswith(IMAGE_EXTENSIONS):
+                    images[filename] = file_path
+        return html_content, images
+
+    with zipfile.ZipFile(path, 'r') as zip_ref:
+        html_content, image_members = read_zip_contents(zip_ref)
+    return html_content, {os.path.basename(info.filename): ArchiveMember(path, info.filename) for info in image_members}
+
+def get_export_state(path):
+    """Something that changes whenever an export (ZIP or directory) is modified"""
+    if not os.path.isdir(path):
+        return get_file_state(path)
+    # Files deleted while the directory is being walked have no state
+    states = (get_file_state(os.path.join(directory, filename))
+              for directory, dirnames, filenames in os.walk(path) for filename in filenames)
+    return tuple(sorted(state for state in states if state is not None))
+
+def render_preview(path, section_cache=None):
+    """Render an export in memory for the preview server, without touching the network.
+
+    Images in the export are served from the export itself and config images
+    from their local files. Returns (html, resources) as PreviewServer expects.
+    """
+    html_content, images = read_export(path)
+    if html_content is None:
+        raise BuildError(f"No HTML document found in {path}")
+
+    resources = {}
+    def get_file_url(local_path):
+        # Numbered rather than the path itself, which may contain ./ or ../ that browsers would resolve
+        return f"/files/{len(resources)}/{os.path.basename(local_path)}"
+
+    def serve(url_path, source):
+        resources[url_path] = lambda: read_image_source(source)
+        return quote(url_path)
+
+    image_upload_mapping = {name: serve(f"/images/{name}", source) for name, source in images.items()}
+    preview_image_mappings = {position: serve(get_file_url(local_path), local_path)
+                              for position, local_path in image_mappings.items()}
+    preview_social_data = [dict(social, social_image=serve(get_file_url(social["social_image"]), social["social_image"]))
+                           for social in social_data]
+
+    email = render_newsletter(html_content, image_upload_mapping, preview_image_mappings, preview_social_data,
+                              section_cache=section_cache, frame_cache_dir=frame_cache_dir)
+    return email.html, resources
+
+def preview(args):
+    """Serve a live preview of an export until interrupted"""
+    if not os.path.exists(args.path):
+        raise BuildError(f"Not found: {args.path}")
+    section_cache = open_section_cache(args.section_cache)
+    with section_cache or contextlib.nullcontext():
+        def render():
+            # The per-section progress output is not useful on every reload
+            with contextlib.redirect_stdout(io.StringIO()):
+                return render_preview(args.path, section_cache)
+
+        try:
+            server = PreviewServer((args.bind, args.port), render, lambda: get_export_state(args.path), watch_interval)
+        except OSError as e:
+            raise BuildError(f"Could not start the preview server on {args.bind}:{args.port}: {e}")
+        print(f"👀 Previewing {args.path} at {server.url} (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nStopped the preview server")
+        finally:
+            server.server_close()
+
+def get_thumbnail_transform():
+    """Optimisation parameters of the thumbnails inlined into drafts"""
+    return {"width": draft_thumbnail_width, "cover": False, "scale": 1, "jpeg_quality": 70, "png_colors": 64}
+
+def get_draft_image_url(source, file_hash, mode, zip_ref=None):
+    """Offline URL of an image for a draft: a data URI thumbnail or a file:// link.
+
+    Images from the ZIP are copied to draft_image_dir (named by their hash) so
+    they can be linked; config assets are linked where they are.
+    """
+    extension = os.path.splitext(get_source_name(source))[1].lower()
+    if mode == "data":
+        data = read_image_source(source, zip_ref)
+        if optimisation_available():
+            thumbnail_path = derive_image(file_hash, get_thumbnail_transform(), lambda: data, extension, derived_image_dir)
+            with open(thumbnail_path, "rb") as f:
+                data = f.read()
+        if len(data) <= draft_data_uri_max_kb * 1024:
+            content_type = mimetypes.guess_type(f"image{extension}")[0] or "application/octet-stream"
+            return f"data:{content_type};base64,{base64.b64encode(data).decode('ascii')}"
+        print(f"⚠️ {get_source_name(source)} is {format_kb(len(data))}, over the {draft_data_uri_max_kb} KB "
+              "data URI limit, linking the file instead")
+
+    if isinstance(source, str):
+        return pathlib.Path(os.path.abspath(source)).as_uri()
+    os.makedirs(draft_image_dir, exist_ok=True)
+    draft_path = os.path.join(draft_image_dir, file_hash + extension)
+    if not os.path.exists(draft_path):
+        tmp_path = f"{draft_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(read_image_source(source, zip_ref))
+        os.replace(tmp_path, draft_path)
+    return pathlib.Path(os.path.abspath(draft_path)).as_uri()
+
+def get_draft_sidecar_path(draft_path):
+    """Where the image list of a draft is kept: next to it, with a .json extension"""
+    return os.path.splitext(draft_path)[0] + ".json"
+
+def build_draft(args, zip_path, section_cache=None):
+    """Generate a proofreading draft of a ZIP export without contacting the image host.
+
+    Images are linked as file:// URLs or inlined as data URI thumbnails. Each
+    image's hash and source is written to a sidecar JSON file next to the draft,
+    so publish() can swap in hosted URLs later. Returns the draft's path.
+    """
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        html_content, images_list = read_zip_contents(zip_ref)
+        if html_content is None:
+            raise BuildError(f"No HTML document found in {zip_path}")
+        print(f"Found HTML document and {len(images_list)} images in {zip_path}")
+
+        sections = parse_sections(html_content, section_cache)
+        referenced_images = get_referenced_images(sections)
+        zip_images = [(info, os.path.basename(info.filename)) for info in images_list
+                      if os.path.basename(info.filename) in referenced_images]
+        for missing in sorted(referenced_images - {original_filename for info, original_filename in zip_images}):
+            print(f"⚠️ Referenced image not found in ZIP: {missing}")
+
+        image_upload_mapping = {}
+        draft_images = []
+        for source, original_filename in zip_images + collect_config_images(get_required_positions(sections)):
+            with open_image_source(source, zip_ref) as image_file:
+                file_hash = get_stream_hash(image_file)
+            url = get_draft_image_url(source, file_hash, args.draft_images, zip_ref)
+            image_upload_mapping[original_filename] = url
+            draft_images.append({
+                "url": url,
+                "original_filename": original_filename,
+                "hash": file_hash,
+                "source_path": os.path.abspath(zip_path if isinstance(source, zipfile.ZipInfo) else source),
+                "member": source.filename if isinstance(source, zipfile.ZipInfo) else None,
+            })
+        print(f"🖼️ Linked {len(draft_images)} images offline ({args.draft_images})")
+
+    updated_image_mappings, updated_social_data = apply_config_urls(image_upload_mapping, quiet=True)
+    # Inlined thumbnails make drafts larger than the published email, so the size budget is not checked
+    draft_path = generate_email(html_content, image_upload_mapping, updated_image_mappings, updated_social_data, sections,
+                                minify=args.minify, section_cache=section_cache,
+                                name="-".join(filter(None, ["draft", args.issue_name])))
+    sidecar_path = get_draft_sidecar_path(draft_path)
+    with open(sidecar_path, "w", encoding="utf-8") as f:
+        json.dump({"zip_path": os.path.abspath(zip_path), "images": draft_images}, f, indent=2)
+    print(f"📝 Draft ready, publish it with: python main.py --publish {draft_path}")
+    return draft_path
+
+def publish(args):
+    """Turn a draft into the final email by swapping its offline image URLs for hosted ones.
+
+    Hosted URLs come from the image cache; images not uploaded yet are uploaded
+    from the draft's sources. The draft is not rendered again. Returns the path
+    of the published email.
+    """
+    draft_path = args.publish
+    sidecar_path = get_draft_sidecar_path(draft_path)
+    if not os.path.exists(draft_path) or not os.path.exists(sidecar_path):
+        raise BuildError(f"{draft_path} is not a draft (both it and {sidecar_path} are needed)")
+    with open(sidecar_path, encoding="utf-8") as f:
+        draft_images = json.load(f)["images"]
+
+    optimise = resolve_optimise(args.optimise)
+    host = create_image_host(args.host, args.workers)
+    image_cache, upload_queue = open_image_cache(host)
+    with host_closing(host), image_cache, upload_queue:
+        to_upload = {}
+        pending = []
+        for image in draft_images:
+            transform = get_image_transform(image["original_filename"], optimise, args.retina)
+            cache_key = get_cache_key(image["hash"], transform, host)
+            image["cache_key"] = cache_key
+            cache_entry = image_cache.get_entry(cache_key)
+            if cache_entry and cache_entry["url"]:
+                continue
+            if cache_entry and cache_entry["page_url"]:
+                pending.append((image["original_filename"], cache_key, cache_entry["page_url"]))
+                continue
+            if not os.path.exists(image["source_path"]):
+                raise BuildError(f"{image['original_filename']} is not hosted yet and {image['source_path']} is gone")
+            source = ArchiveMember(image["source_path"], image["member"]) if image["member"] else image["source_path"]
+            to_upload[cache_key] = (get_upload_source(source, image["hash"], transform), image["original_filename"], cache_key)
+
+        if to_upload:
+            print(f"Uploading {len(to_upload)} images missing from the image cache...")
+            upload_queue.enqueue([get_queue_item(source, original_filename, cache_key)
+                                  for source, original_filename, cache_key in to_upload.values()])
+            authenticate_host(host)
+            uploaded, upload_pending = upload_images(host, list(to_upload.values()), args.workers,
+                                                     image_cache=image_cache, upload_queue=upload_queue)
+            pending.extend(upload_pending)
+        resolve_direct_links(host, pending, args.workers, image_cache)
+
+        hosted_urls = {}
+        for image in draft_images:
+            url = image_cache.get(image["cache_key"])
+            if url:
+                hosted_urls[image["url"]] = url
+        image_cache.mark_used(image["cache_key"] for image in draft_images if image["url"] in hosted_urls)
+        unhosted = sorted({image["original_filename"] for image in draft_images if image["url"] not in hosted_urls})
+        if unhosted:
+            raise BuildError(f"{len(unhosted)} images have no hosted URL: {', '.join(unhosted)}. "
+                             "Fix the problem and publish again.")
+
+    with open(draft_path, encoding="utf-8") as f:
+        draft = f.read()
+    if hosted_urls:
+        pattern = re.compile("|".join(re.escape(url) for url in sorted(hosted_urls, key=len, reverse=True)))
+        draft = pattern.sub(lambda match: hosted_urls[match.group(0)], draft)
+
+    filepath = write_email(draft)
+    print(f"✅ Published {len(hosted_urls)} images, HTML file generated successfully as {filepath}")
+    total = print_size_report({"email": len(draft.encode("utf-8"))}, args.size_budget)
+    if over_budget(total, args.size_budget):
+        raise BuildError(f"The email is {format_kb(total)}, over the {args.size_budget} KB budget "
+                         f"(Gmail clips messages over {GMAIL_CLIP_KB} KB)")
+    return filepath
+
+def serve(args):
+    """Run the build service until interrupted.
+
+    Every build shares one image host session (so the login happens once), the
+    image cache with its memoised config asset hashes, and the section cache.
+    Uploads are done by one build at a time, so builds that need the same new
+    image upload it once.
+    """
+    optimise = resolve_optimise(args.optimise)
+    host = create_image_host(args.host, args.workers)
+    image_cache, upload_queue = open_image_cache(host)
+    section_cache = open_section_cache(args.section_cache)
+    upload_lock = threading.Lock()
+
+    with host_closing(host), image_cache, upload_queue, section_cache or contextlib.nullcontext():
+        def build_job(job):
+            job_args = argparse.Namespace(**vars(args))
+            job_args.issue_name = job.id
+            with zipfile.ZipFile(job.zip_path, 'r') as zip_ref:
+                return build_from_zip(job_args, job.zip_path, zip_ref, host, image_cache, upload_queue, args.workers,
+                                      optimise, section_cache, upload_lock)
+
+        try:
+            server = BuildService((args.bind, args.port), build_job, service_upload_dir, args.jobs, service_max_upload_mb)
+        except OSError as e:
+            raise BuildError(f"Could not start the build service on {args.bind}:{args.port}: {e}")
+        try:
+            # Log in before any job runs, so the login output never ends up in a job log anyone can download
+            authenticate_host(host)
+        except BuildError:
+            server.server_close()
+            raise
+        if not ipaddress.ip_address(server.server_address[0]).is_loopback:
+            print(f"⚠️ The build service has no access control and is reachable by anyone who can reach {args.bind}")
+        print(f"🌐 Build service running at {server.url} with {args.jobs} builds at a time (Ctrl+C to stop)")
+        try:
+            # What each build prints goes to its job's log
+            with contextlib.redirect_stdout(server.output):
+                server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nStopped the build service")
+        finally:
+            server.server_close()
+
+def find_batch_zips(paths):
+    """Expand ZIP files, directories and glob patterns into a sorted list of ZIP paths"""
+    zip_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = glob.glob(os.path.join(path, "*.zip"))
+        elif glob.has_magic(path):
+            matches = glob.glob(path)
+        else:
+            matches = [path]
+        zip_paths.extend(sorted(matches))
+    return list(dict.fromkeys(os.path.abspath(zip_path) for zip_path in zip_paths))
+
+def init_batch_worker():
+    """Apply the settings main() applies, for worker processes that do not inherit them"""
+    configure_html_parser(html_parser_backend)
+    configure_templates(jinja_cache_dir)
+
+def plan_issue(args, zip_path):
+    """Batch worker: find the uploads an issue needs, without uploading anything.
+
+    Returns a dict with the queue items to upload, the direct links still
+    pending, the captured output and any error.
+    """
+    started = time.time()
+    output = io.StringIO()
+    result = {"zip_path": zip_path, "uploads": [], "pending": [], "error": None}
+    try:
+        with contextlib.redirect_stdout(output):
+            host = create_image_host(args.host)
+            # The parent has already imported any legacy JSON cache
+            image_cache = ImageCache(image_cache_path)
+            section_cache = open_section_cache(args.section_cache)
+            with host_closing(host), image_cache, section_cache or contextlib.nullcontext(), \
+                    zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                html_content, images_list = read_zip_contents(zip_ref)
+                if html_content is None:
+                    raise BuildError(f"No HTML document found in {zip_path}")
+                sections = parse_sections(html_content, section_cache)
+                image_upload_mapping, images_to_upload, all_images, missing_images = plan_images(
+                    args, zip_ref, sections, images_list, host, image_cache, resolve_optimise(args.optimise), result["pending"])
+                result["uploads"] = [get_queue_item(source, original_filename, cache_key, zip_path)
+                                     for source, original_filename, cache_key in images_to_upload]
+    except Exception as e:
+        result["error"] = str(e)
+    result["log"] = output.getvalue()
+    result["seconds"] = time.time() - started
+    return result
+
+def build_issue(args, zip_path):
+    """Batch worker: build one issue, whose images have all been uploaded already"""
+    started = time.time()
+    output = io.StringIO()
+    issue_args = argparse.Namespace(**vars(args))
+    issue_args.zip_path = zip_path
+    issue_args.resume = False
+    issue_args.watch = False
+    issue_args.draft = False
+    issue_args.publish = None
+    issue_args.issue_name = os.path.splitext(os.path.basename(zip_path))[0]
+    result = {"zip_path": zip_path, "output": None, "error": None}
+    try:
+        with contextlib.redirect_stdout(output):
+            result["output"] = build(issue_args)
+    except Exception as e:
+        result["error"] = str(e)
+    result["log"] = output.getvalue()
+    result["seconds"] = time.time() - started
+    return result
+
+def print_issue_log(result):
+    print(f"── {os.path.basename(result['zip_path'])} " + "─" * 30)
+    print(result["log"].rstrip())
+
+def batch(args):
+    """Build many issues: plan them in parallel, upload the images they need once, then build them in parallel.
+
+    Planning and building run in a process pool and share the SQLite image and
+    section caches. Uploads happen in this process through a single upload queue
+    and host session, so an image used by several issues is uploaded once and the
+    host is logged in to at most once.
+    """
+    zip_paths = find_batch_zips(args.paths)
+    missing = [zip_path for zip_path in zip_paths if not os.path.isfile(zip_path)]
+    if missing:
+        raise BuildError(f"Not found: {', '.join(missing)}")
+    if not zip_paths:
+        raise BuildError("No ZIP files found")
+
+    jobs = max(1, min(args.jobs or os.cpu_count() or 1, len(zip_paths)))
+    args.optimise = resolve_optimise(args.optimise)
+    host = create_image_host(args.host, args.workers)
+    if not host.persistent:
+        host.close()
+        raise BuildError(f"Batch mode shares uploads through the image cache, which the {host.name} host does not use")
+    image_cache, upload_queue = open_image_cache(host)
+    started = time.time()
+    print(f"Processing {len(zip_paths)} issues with {jobs} parallel jobs")
+
+    with host_closing(host), image_cache, upload_queue, \
+            ProcessPoolExecutor(max_workers=jobs, initializer=init_batch_worker) as executor:
+        # Plan every issue, then upload the images they need as one deduplicated batch
+        plans = {}
+        for plan in executor.map(plan_issue, [args] * len(zip_paths), zip_paths):
+            print_issue_log(plan)
+            plans[plan["zip_path"]] = plan
+
+        uploads = {}
+        pending_links = {}
+        for plan in plans.values():
+            for item in plan["uploads"]:
+                uploads.setdefault(item[0], item)
+            for original_filename, cache_key, page_url in plan["pending"]:
+                pending_links.setdefault(cache_key, (original_filename, cache_key, page_url))
+        shared = sum(len(plan["uploads"]) for plan in plans.values()) - len(uploads)
+
+        print("=" * 50)
+        if uploads:
+            print(f"Uploading {len(uploads)} images for all issues ({shared} shared between issues)...")
+            upload_queue.enqueue(uploads.values())
+            authenticate_host(host)
+            images_to_upload = [(get_queue_source(item), item[1], item[0]) for item in uploads.values()]
+            uploaded, upload_pending = upload_images(host, images_to_upload, args.workers, None, image_cache, upload_queue)
+            for original_filename, cache_key, page_url in upload_pending:
+                pending_links.setdefault(cache_key, (original_filename, cache_key, page_url))
+        else:
+            print("🎉 All images found in cache! No uploads needed.")
+        resolve_direct_links(host, list(pending_links.values()), args.workers, image_cache)
+
+        # Issues with an image that could not be hosted are not built, so no worker retries the upload
+        results = {}
+        buildable = []
+        for zip_path, plan in plans.items():
+            unhosted = [item[1] for item in plan["uploads"] if not image_cache.get(item[0])]
+            unhosted += [original_filename for original_filename, cache_key, page_url in plan["pending"]
+                         if not image_cache.get(cache_key)]
+            if plan["error"]:
+                results[zip_path] = {"status": "failed", "error": plan["error"]}
+            elif unhosted:
+                results[zip_path] = {"status": "failed", "error": f"{len(unhosted)} images have no hosted URL "
+                                                                   f"({', '.join(sorted(set(unhosted)))}), run the batch again to retry"}
+            else:
+                buildable.append(zip_path)
+
+        print("=" * 50)
+        for build_result in executor.map(build_issue, [args] * len(buildable), buildable):
+            print_issue_log(build_result)
+            results[build_result["zip_path"]] = {
+                "status": "failed" if build_result["error"] else "ok",
+                "error": build_result["error"],
+                "output": build_result["output"],
+                "build_seconds": round(build_result["seconds"], 3),
+            }
+
+    summary = []
+    for zip_path in zip_paths:
+        entry = {"zip": zip_path, "plan_seconds": round(plans[zip_path]["seconds"], 3),
+                 "uploads": len(plans[zip_path]["uploads"])}
+        entry.update(results[zip_path])
+        summary.append(entry)
+    write_batch_summary(summary, time.time() - started)
+
+    failed = [entry for entry in summary if entry["status"] != "ok"]
+    if failed:
+        raise BuildError(f"{len(failed)} of {len(summary)} issues failed")
+
+def write_batch_summary(summary, seconds):
+    """Print the per-issue results and save them next to the emails as JSON"""
+    print("=" * 50)
+    print("Batch summary")
+    print("=" * 50)
+    for entry in summary:
+        timing = f"{entry['plan_seconds'] + entry.get('build_seconds', 0):6.2f}s"
+        if entry["status"] == "ok":
+            print(f"✅ {os.path.basename(entry['zip'])}  {timing}  -> {entry['output']}")
+        else:
+            print(f"❌ {os.path.basename(entry['zip'])}  {timing}  {entry['error']}")
+
+    os.makedirs("emails", exist_ok=True)
+    summary_path = os.path.join("emails", f"batch-summary-{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump({"seconds": round(seconds, 3), "issues": summary}, f, indent=4)
+    print(f"Finished {len(summary)} issues in {seconds:.2f}s, summary written to {summary_path}")
+
+def plan_images(args, zip_ref, sections, images_list, host, image_cache, optimise, pending_links):
+    """Find the hosted URL of every image the sections and config use, or what is needed to get one.
+
+    Images whose direct link is still to be resolved are added to pending_links.
+    Returns (image_upload_mapping, images_to_upload, all_images, missing_images),
+    where images_to_upload is a list of (source, original_filename, cache_key)
+    and missing_images the referenced images that are not in the ZIP.
+    """
+    image_upload_mapping = {}
+    images_to_upload = []
+    referenced_images = get_referenced_images(sections)
+    zip_images = []
+    for info in images_list:
+        if os.path.basename(info.filename) in referenced_images:
+            zip_images.append((info, os.path.basename(info.filename)))
+        else:
+            print(f"⏭️ Not referenced by any section, skipping: {info.filename}")
+    
+    missing_images = referenced_images - {original_filename for info, original_filename in zip_images}
+    for missing in sorted(missing_images):
+        print(f"⚠️ Referenced image not found in ZIP: {missing}")
+    
     # Combine zip images and config images
-    all_images = [(path, os.path.basename(path)) for path in images_list] + config_images
+    all_images = zip_images + collect_config_images(get_required_positions(sections))
+    asset_manifest = load_asset_manifest(asset_manifest_path)
+    used_keys = []
     
-    for image_path, original_filename in all_images:
-        file_hash = get_file_hash(image_path)
+    for source, original_filename in all_images:
+        transform = get_image_transform(original_filename, optimise, args.retina)
+        if isinstance(source, zipfile.ZipInfo):
+            with open_image_source(source, zip_ref) as image_file:
+                file_hash = get_stream_hash(image_file)
+        else:
+            # Unchanged config assets are resolved from the manifest without reading them
+            manifest_entry = lookup_asset(asset_manifest, source, transform, host.name)
+            if manifest_entry and manifest_entry.get("url"):
+                image_upload_mapping[original_filename] = manifest_entry["url"]
+                used_keys.append(get_cache_key(manifest_entry["hash"], transform, host))
+                print(f"✅ Manifest: {original_filename} -> {manifest_entry['url']}")
+                continue
+            file_hash = get_asset_hash(source, image_cache)
         
         # Check if image is in cache with same hash
-        if file_hash in image_cache:
-            cached_url = image_cache[file_hash]
-            image_upload_mapping[original_filename] = cached_url
-            print(f"✅ Cached: {original_filename} -> {cached_url}")
+        cache_key = get_cache_key(file_hash, transform, host)
+        cache_entry = image_cache.get_entry(cache_key)
+        if cache_entry and cache_entry["url"]:
+            image_upload_mapping[original_filename] = cache_entry["url"]
+            used_keys.append(cache_key)
+            print(f"✅ Cached: {original_filename} -> {cache_entry['url']}")
+        elif cache_entry and cache_entry["page_url"]:
+            # Uploaded before but the direct link lookup failed, retry that instead of re-uploading
+            pending_links.append((original_filename, cache_key, cache_entry["page_url"]))
+            print(f"⏳ Direct link pending: {original_filename}")
         else:
-            images_to_upload.append((image_path, original_filename, file_hash))
+            upload_source = get_upload_source(source, file_hash, transform, zip_ref)
+            images_to_upload.append((upload_source, original_filename, cache_key))
             print(f"📤 Need to upload: {original_filename}")
-    
-    # Upload new images if any
-    if images_to_upload:
-        print(f"\nUploading {len(images_to_upload)} new images...")
-        
-        # Login to postimages.org
-        session = login_to_postimages()
-        if not session:
-            print("❌ Failed to login to postimages.org. Exiting.")
-            return
-        
-        # Get API key
-        api_key = get_api_key(session)
-        if not api_key:
-            print("❌ Failed to get API key. Exiting.")
-            return
-        
-        # Upload new images
-        for image_path, original_filename, file_hash in images_to_upload:
-            print(f"\nUploading: {image_path}")
-            upload_result = upload_image(session, api_key, image_path)
-            if upload_result and upload_result.get('direct_link'):
-                uploaded_url = upload_result['direct_link']
-                image_upload_mapping[original_filename] = uploaded_url
-                # Add to cache
-                image_cache[file_hash] = uploaded_url
-                print(f"✅ Uploaded: {original_filename} -> {uploaded_url}")
-            else:
-                print(f"❌ Failed to upload: {image_path}")
-        
-        # Save updated cache
-        save_image_cache(image_cache)
-        print(f"\nCache updated with {len(images_to_upload)} new entries")
-    else:
-        print("\n🎉 All images found in cache! No uploads needed.")
-    
-    print(f"\nTotal images processed: {len(image_upload_mapping)}")
-    #print("Image mapping:", image_upload_mapping)
-    
+
+    # Keep the images this build reuses from being pruned as unused
+    image_cache.mark_used(used_keys)
+    return image_upload_mapping, images_to_upload, all_images, missing_images
+
+def apply_config_urls(image_upload_mapping, quiet=False):
+    """Copies of image_mappings and social_data pointing at the URLs found for the config images.
+
+    quiet skips printing every URL (drafts' data URIs are too long to read).
+    Returns (updated_image_mappings, updated_social_data).
+    """
     # Update image_mappings with uploaded URLs for config images
     updated_image_mappings = image_mappings.copy()
     for position, local_path in image_mappings.items():
         config_key = f"config_{position}"
         if config_key in image_upload_mapping:
             updated_image_mappings[position] = image_upload_mapping[config_key]
-            print(f"✅ Updated mapping: {position} -> {image_upload_mapping[config_key]}")
+            if not quiet:
+                print(f"✅ Updated mapping: {position} -> {image_upload_mapping[config_key]}")
     
     # Update social_data with uploaded URLs
     updated_social_data = []
@@ -225,179 +1256,542 @@ def main():
         config_key = f"config_social_{os.path.basename(local_path)}"
         if config_key in image_upload_mapping:
             updated_social["social_image"] = image_upload_mapping[config_key]
-            print(f"✅ Updated social: {os.path.basename(local_path)} -> {image_upload_mapping[config_key]}")
+            if not quiet:
+                print(f"✅ Updated social: {os.path.basename(local_path)} -> {image_upload_mapping[config_key]}")
         updated_social_data.append(updated_social)
-                
-    finished_html = generate_email(html_file_path, image_upload_mapping, updated_image_mappings, updated_social_data)
-    #print(images_list)
-    
-    # Clean up temporary directory
-    cleanup_temp_directory(tmp_dir)
+    return updated_image_mappings, updated_social_data
 
-def generate_email(html_file_path, image_upload_mapping=None, updated_image_mappings=None, updated_social_data=None):
-    with open(html_file_path, "r", encoding="utf-8") as file:
-        content = file.read()
-        
-        # Replace local image paths with uploaded URLs if mapping is provided
-        if image_upload_mapping:
-            for local_filename, uploaded_url in image_upload_mapping.items():
-                # Replace various possible image path patterns
-                content = content.replace(f'src="images/{local_filename}"', f'src="{uploaded_url}"')
-                content = content.replace(f'src="tmp/images/{local_filename}"', f'src="{uploaded_url}"')
-                content = content.replace(f'src="./images/{local_filename}"', f'src="{uploaded_url}"')
-                content = content.replace(f'src="../images/{local_filename}"', f'src="{uploaded_url}"')
-                print(f"Replaced image reference: {local_filename} -> {uploaded_url}")
+def recheck_uploads(images_to_upload, image_cache, image_upload_mapping, pending_links):
+    """Drop the planned uploads that have reached the image cache since they were planned.
+
+    Their URLs are added to image_upload_mapping, or their page URLs to pending_links.
+    Returns the uploads that are still needed.
+    """
+    remaining = []
+    for source, original_filename, cache_key in images_to_upload:
+        cache_entry = image_cache.get_entry(cache_key)
+        if cache_entry and cache_entry["url"]:
+            image_upload_mapping[original_filename] = cache_entry["url"]
+            print(f"✅ Cached since planning: {original_filename} -> {cache_entry['url']}")
+        elif cache_entry and cache_entry["page_url"]:
+            pending_links.append((original_filename, cache_key, cache_entry["page_url"]))
+            print(f"⏳ Direct link pending: {original_filename}")
         else:
-            # Fallback to original behavior
-            content = content.replace('src="images/image', 'src="tmp/images/image')
-        
-        data_content = content.split("<body>")[0].split("</body>")[0]
-        sections = re.split(r'<p class="c\d+"><span class="c\d+">&mdash; ', data_content)
-        print("Total sections found:", len(sections))
+            remaining.append((source, original_filename, cache_key))
+    return remaining
+
+def upload_zip_images(args, zip_path, zip_ref, sections, images_list, host, image_cache, upload_queue, workers, optimise,
+                      upload_lock=None):
+    """Find or upload the hosted URL of every image the sections and config use.
+
+    Images are hashed and optimised straight away; only the uploads hold upload_lock,
+    and once it is held the planned uploads are checked against the image cache again.
+    Returns (image_upload_mapping, all_images, missing_images) like plan_images(),
+    with the new uploads and resolved direct links added to the mapping.
+    """
+    # Check cache first, then upload if needed
+    pending_links = []
+    image_upload_mapping, images_to_upload, all_images, missing_images = plan_images(
+        args, zip_ref, sections, images_list, host, image_cache, optimise, pending_links)
+    
+    with upload_lock or contextlib.nullcontext():
+        if args.resume:
+            resumable = get_resumable_uploads(upload_queue, image_cache, zip_ref, zip_path, host)
+            if resumable:
+                print(f"Resuming {len(resumable)} queued uploads from the previous run...")
+                authenticate_host(host)
+                uploaded, upload_pending = upload_images(host, resumable, workers, zip_ref, image_cache, upload_queue)
+                pending_links.extend(upload_pending)
+            else:
+                print(f"Nothing queued for {host.name} from the previous run")
         
-        position_content_list = []
+        # Resumed uploads or another build sharing upload_lock may have uploaded some of them by now
+        images_to_upload = recheck_uploads(images_to_upload, image_cache, image_upload_mapping, pending_links)
         
-        for i in range(1, len(sections)):
-            section_content = sections[i].split("</span>")[0].strip().replace(" ", "-").lower()  # Get the content, clean up
-            print("Processing section:", section_content)
-            cool = "".join(sections[i].split("</span>")[1:])  # Print the content after </span>
+        # Upload new images if any
+        if images_to_upload:
+            print(f"\nUploading {len(images_to_upload)} new images...")
+            upload_queue.enqueue([
+                get_queue_item(source, original_filename, cache_key, zip_path)
+                for source, original_filename, cache_key in images_to_upload
+            ])
             
-            # Fix nested image structure by flattening nested spans containing images
-            soup = BeautifulSoup(cool, "html.parser")
-            for img in soup.find_all('img'):
-                # Find the outermost span containing this image
-                parent_span = img.find_parent('span')
-                if parent_span:
-                    # Move the image out of the nested span structure
-                    parent_span.insert_before(img)
-                    # Remove the span if it's now empty
-                    if not parent_span.get_text(strip=True) and not parent_span.find_all('img'):
-                        parent_span.decompose()
+            authenticate_host(host)
             
-            # Ensure each image is in its own paragraph for vertical stacking
-            for img in soup.find_all('img'):
-                # Check if the image is not already in its own paragraph
-                if img.parent.name != 'p':
-                    # Create a new paragraph for the image
-                    new_p = soup.new_tag('p')
-                    new_p['style'] = 'text-align: center; margin: 10px 0;'
-                    img.wrap(new_p)
-            
-            # Get the cleaned content
-            cool = str(soup)
-            
-            len_cool = soup.get_text(strip=True)  # Get the text content without HTML tags        
+            # Upload new images
+            uploaded, upload_pending = upload_images(host, images_to_upload, workers, zip_ref, image_cache, upload_queue)
+            for original_filename, file_hash, uploaded_url in uploaded:
+                image_upload_mapping[original_filename] = uploaded_url
+            pending_links.extend(upload_pending)
             
-            # Correcting the structure to match our expected dictionary
-            position_content_list.append({
-                "position": section_content,  # Assuming the first word is the position
-                "content": cool,
-                "length": len(len_cool)  # Length of the content
-            })
-        
-        # Creating the final structure
-        final_data = {
-            "total_sections": len(position_content_list),
-            "sections": position_content_list
-        }
+            print(f"\nCache updated with {len(uploaded) + len(upload_pending)} new entries")
+        else:
+            print("\n🎉 All images found in cache! No uploads needed.")
+    
+    # Direct links are resolved lazily, in one batch after the uploads
+    for original_filename, file_hash, direct_url in resolve_direct_links(host, pending_links, workers, image_cache):
+        image_upload_mapping[original_filename] = direct_url
+    return image_upload_mapping, all_images, missing_images
+
+def build_from_zip(args, zip_path, zip_ref, host, image_cache, upload_queue, workers, optimise, section_cache=None,
+                   upload_lock=None):
+    """Upload the images of an opened newsletter ZIP and generate the email, returning its path.
+
+    Builds running side by side can share an upload_lock, so an image they both
+    need is uploaded by the first one and found in the image cache by the others.
+    """
+    html_content, images_list = read_zip_contents(zip_ref)
+    if html_content is None:
+        raise BuildError(f"No HTML document found in {zip_path}")
+    print(f"Found HTML document and {len(images_list)} images in {zip_path}")
 
-    # Output the result as a JSON formatted string
-    json_output = json.dumps(final_data, indent=4)
+    print("=" * 50)
+    print(f"Image cache opened with {len(image_cache)} entries")
+    
+    # Work out which images the email actually uses before hashing anything
+    sections = parse_sections(html_content, section_cache)
     
+    # Upload images to the image host
+    print("=" * 50)
+    print("Processing images for upload")
+    print("=" * 50)
+    
+    image_upload_mapping, all_images, missing_images = upload_zip_images(
+        args, zip_path, zip_ref, sections, images_list, host, image_cache, upload_queue, workers, optimise, upload_lock)
+    
+    # Never produce an email that points at local images
+    unhosted = sorted(missing_images | {original_filename for source, original_filename in all_images
+                                        if original_filename not in image_upload_mapping})
+    if unhosted:
+        raise BuildError(f"{len(unhosted)} referenced images have no hosted URL: {', '.join(unhosted)}. "
+                         "Fix the problem and run again with --resume.")
+    
+    print(f"\nTotal images processed: {len(image_upload_mapping)}")
+    #print("Image mapping:", image_upload_mapping)
+    
+    updated_image_mappings, updated_social_data = apply_config_urls(image_upload_mapping)
+    return generate_email(html_content, image_upload_mapping, updated_image_mappings, updated_social_data, sections,
+                          minify=args.minify, size_budget_kb=args.size_budget, section_cache=section_cache,
+                          name=args.issue_name)
+
+SPECIAL_SECTIONS = ("email-start", "email-end", "email-subject")
+
+# Local image references in any quoting style, e.g. src="images/a.png", src='./images/a.png' or src=../images/a.png
+IMAGE_SRC_PATTERN = re.compile(r'''src\s*=\s*(["']?)(?:\./|\.\./)?(?:tmp/)?images/([^"'\s>]+)\1''')
+
+def is_rendered_section(section):
+    """Whether generate_email() renders a section as a content block"""
+    return section["length"] > 0 and section["position"] not in SPECIAL_SECTIONS
+
+def get_required_positions(sections):
+    """Header image positions the email uses: the logo plus every rendered section"""
+    positions = {"logo"}
+    positions.update(section["position"] for section in sections if is_rendered_section(section))
+    return positions
+
+def get_referenced_images(sections):
+    """Filenames of the images/... sources used by the sections that end up in the email"""
+    referenced = set()
+    for section in sections:
+        if is_rendered_section(section) or section["position"] in SPECIAL_SECTIONS:
+            referenced.update(match.group(2) for match in IMAGE_SRC_PATTERN.finditer(section["content"]))
+    return referenced
+
+def rewrite_image_sources(content, image_upload_mapping, unresolved=None):
+    """Point every local images/... src at its hosted URL in a single pass over content.
+
+    Each reference is resolved with one dict lookup, so the cost is linear in the
+    size of the document however many images there are. References missing from
+    image_upload_mapping are left as they are and added to the unresolved set.
+    """
+    def replace(match):
+        uploaded_url = image_upload_mapping.get(match.group(2))
+        if uploaded_url is None:
+            if unresolved is not None:
+                unresolved.add(match.group(2))
+            return match.group(0)
+        return f'src="{uploaded_url}"'
+
+    return IMAGE_SRC_PATTERN.sub(replace, content)
+
+SECTION_MARKER = "\u2014 "  # "&mdash; " once the entity is decoded
+
+def get_section_marker(node):
+    """Return the marker span if node is a Google Docs section heading (<p><span>&mdash; Name</span>...), else None"""
+    if not isinstance(node, Tag) or node.name != 'p' or not node.contents:
+        return None
+    first = node.contents[0]
+    if isinstance(first, Tag) and first.name == 'span' and first.get_text().startswith(SECTION_MARKER):
+        return first
+    return None
+
+def get_node_text(node, strip=False):
+    """Text of a tag or string node, like BeautifulSoup's get_text()"""
+    if isinstance(node, Comment):
+        return ""
+    if isinstance(node, NavigableString):
+        return node.strip() if strip else str(node)
+    return node.get_text(strip=strip)
+
+def flatten_image(soup, img):
+    """Pull an image out of its span and give it a paragraph of its own for vertical stacking.
+
+    An image in a paragraph with text splits it: the image's paragraph goes after
+    the original one, followed by a copy of it holding whatever came after the
+    image. Returns (paragraph, new_nodes) when a paragraph was split, else None.
+    """
+    # Fix nested image structure by flattening nested spans containing images
+    parent_span = img.find_parent('span')
+    if parent_span:
+        # Move the image out of the nested span structure
+        parent_span.insert_before(img)
+        # Remove the span if it's now empty
+        if not parent_span.get_text(strip=True) and not parent_span.find_all('img'):
+            parent_span.decompose()
+
+    # Ensure the image is in its own paragraph
+    paragraph = img.parent
+    if paragraph.name != 'p':
+        new_p = soup.new_tag('p')
+        new_p['style'] = 'text-align: center; margin: 10px 0;'
+        img.wrap(new_p)
+        return None
+    # Section headings are not split, their paragraph is not part of the section content
+    if not paragraph.get_text(strip=True) or get_section_marker(paragraph) is not None:
+        return None
+
+    trailing = list(img.next_siblings)
+    new_p = soup.new_tag('p')
+    new_p['style'] = 'text-align: center; margin: 10px 0;'
+    paragraph.insert_after(new_p)
+    new_p.append(img.extract())
+    new_nodes = [new_p]
+    if any(isinstance(node, Tag) or node.strip() for node in trailing):
+        # The text after the image keeps the paragraph's (already inlined) style
+        rest = soup.new_tag('p')
+        rest.attrs = {name: list(value) if isinstance(value, list) else value for name, value in paragraph.attrs.items()}
+        for node in trailing:
+            rest.append(node.extract())
+        new_p.insert_after(rest)
+        new_nodes.append(rest)
+    if not paragraph.get_text(strip=True) and not paragraph.find('img'):
+        paragraph.decompose()
+    return paragraph, new_nodes
+
+# Section headings in the raw export, found without parsing it
+RAW_SECTION_MARKER_PATTERN = re.compile(r'<p\b[^>]*><span\b[^>]*>(?:&mdash;|&#8212;|&#x2014;|\u2014) ', re.IGNORECASE)
+STYLE_PATTERN = re.compile(r'<style\b[^>]*>(.*?)</style\s*>', re.DOTALL | re.IGNORECASE)
+# Bump when parse or render output changes, so cached sections are not reused
+SECTION_CACHE_VERSION = 2
+
+def split_raw_sections(html_content):
+    """Raw HTML of each section, cut at the heading paragraphs"""
+    starts = [match.start() for match in RAW_SECTION_MARKER_PATTERN.finditer(html_content)]
+    return [html_content[start:end] for start, end in zip(starts, starts[1:] + [len(html_content)])]
 
-    # Printing the generated JSON output
-    #print(json_output)
+def parse_sections(html_content, section_cache=None):
+    """Split the exported document into sections on the Google Docs "&mdash; Name" headings.
 
-    # Jinja2 template for rendering the HTML
+    With a section cache, the raw export is cut at the headings and only the
+    sections whose raw HTML (or the stylesheet and style settings) changed since
+    they were cached are parsed, each on its own. Otherwise the whole document is
+    parsed at once.
+
+    Returns a list of {"position", "content", "length", "text"} dicts, where text
+    is the section's plain text and length the length of its text without whitespace.
+    """
+    fragments = split_raw_sections(html_content) if section_cache is not None else []
+    if not fragments:
+        sections = split_sections(html_content)
+        print("Total sections found:", len(sections))
+        return sections
+
+    stylesheet = "".join(STYLE_PATTERN.findall(html_content))
+    settings = (SECTION_CACHE_VERSION, get_tree_builder(), stylesheet, inline_css_properties, house_styles, house_attributes)
+    sections = []
+    reused = 0
+    for fragment in fragments:
+        key = make_key(*settings, fragment)
+        section = section_cache.get_parsed(key)
+        if section is not None:
+            reused += 1
+        else:
+            parsed = split_sections(fragment, stylesheet)
+            if len(parsed) != 1:
+                # The heading was not one the parser recognises, so parse the whole document instead
+                sections = split_sections(html_content)
+                print("Total sections found:", len(sections))
+                return sections
+            section = parsed[0]
+            section_cache.put_parsed(key, section)
+        sections.append(section)
+
+    print("Total sections found:", len(sections))
+    if reused:
+        print(f"♻️ {reused} unchanged sections reused from the section cache")
+    return sections
+
+def split_sections(html_content, stylesheet=None):
+    """Parse a document (or the raw HTML of some of its sections) and transform its sections.
+
+    The document is parsed once. Section boundaries are found among the top level
+    elements of the body, and the image transforms run in the same pass that
+    collects each section's nodes.
+
+    Class styles from the export's stylesheet (or the stylesheet given, when only
+    part of the document is passed) and the house styles from config.py are
+    inlined onto the section content (see lib/css_inliner.py).
+    """
+    soup = make_soup(html_content)
+    body = soup.body or soup
+
+    grouped_sections = []
+    current = None
+    for node in list(body.children):
+        marker = get_section_marker(node)
+        if marker is not None:
+            position = marker.get_text()[len(SECTION_MARKER):].strip().replace(" ", "-").lower()
+            # Anything after the heading span in the same paragraph belongs to the section
+            current = (position, [child for child in node.contents[1:]])
+            grouped_sections.append(current)
+        elif current is not None:
+            current[1].append(node)
+
+    # The export's own class rules, inlined together with the house styles
+    if stylesheet is None:
+        stylesheet = "".join(style.get_text() for style in soup.find_all('style'))
+    inliner = get_inliner(stylesheet, inline_css_properties, house_styles, house_attributes)
+
+    position_content_list = []
+    for position, nodes in grouped_sections:
+        print("Processing section:", position)
+        section_nodes = list(nodes)
+        for node in nodes:
+            if isinstance(node, Tag):
+                for element in [node] + node.find_all(True):
+                    if element.name == 'img':
+                        split = flatten_image(soup, element)
+                        if split:
+                            # Paragraphs split off a top level paragraph belong to the section too
+                            paragraph, new_nodes = split
+                            index = next((i for i, existing in enumerate(section_nodes) if existing is paragraph), None)
+                            if index is not None:
+                                section_nodes[index + 1:index + 1] = new_nodes
+                    else:
+                        inliner.inline(element)
+
+        # Flattening may have moved nodes, so serialise what is left in order
+        nodes = [node for node in section_nodes if node.parent is not None]
+        position_content_list.append({
+            "position": position,
+            "content": "".join(str(node) for node in nodes),
+            "length": sum(len(get_node_text(node, strip=True)) for node in nodes),  # Length of the content
+            "text": "".join(get_node_text(node) for node in nodes).strip(),
+        })
+
+    return position_content_list
+
+def get_output_path(name=None):
+    """Timestamped path for a generated email in emails/, with name added when given"""
+    current_datetime = datetime.datetime.now()
+    current_date = current_datetime.strftime("%Y-%m-%d")
+    current_time = current_datetime.strftime("%H-%M-%S")
     
-    # Initialize the Jinja2 template engine
-    template = Template(html_template)
-    socials = Template(social_template)
-    start_template = Template(start)
-    end_template = Template(end)
+    # Create emails directory if it doesn't exist
+    emails_dir = "emails"
+    os.makedirs(emails_dir, exist_ok=True)
+    
+    prefix = f"mps-email-{name}" if name else "mps-email"
+    filename = f"{prefix}-{current_date}-{current_time}.html"
+    return os.path.join(emails_dir, filename)
+
+def get_section_text(section):
+    """Plain text of a parsed section, collected while parsing the document"""
+    return section.get("text") or get_text(section["content"]).strip()
+
+def render_email(html_content, image_upload_mapping=None, updated_image_mappings=None, updated_social_data=None, sections=None,
+                 minify=False, section_cache=None, unresolved=None, frame_cache_dir=None):
+    """Render the newsletter, returning (label, chunk) pairs in document order as they are produced.
+
+    Labels name the part of the email each chunk belongs to (see generate_frame()).
+    With minify, each fragment is minified. A section cache (lib/section_cache.py)
+    lets unchanged sections skip rendering. Image references missing from
+    image_upload_mapping are added to the unresolved set when one is given. The
+    prerendered shell is also kept on disk under frame_cache_dir when it is set.
+    """
+    # Reuse the sections when the caller has already parsed the document
+    if sections is None:
+        sections = parse_sections(html_content, section_cache)
+    position_content_list = [dict(section) for section in sections]
+    
+    # Replace local image paths with uploaded URLs
+    if unresolved is None:
+        unresolved = set()
+    for section in position_content_list:
+        section["content"] = rewrite_image_sources(section["content"], image_upload_mapping or {}, unresolved)
+    for local_filename in sorted(unresolved):
+        print(f"⚠️ Unresolved image reference: {local_filename}")
+    
+    # Templates are compiled once per process and cached on disk between runs
+    template = get_template("section")
     
     # Use updated mappings if provided, otherwise use original
     final_image_mappings = updated_image_mappings if updated_image_mappings else image_mappings
     final_social_data = updated_social_data if updated_social_data else social_data
 
-    # Render HTML for each section in the JSON data
-    rendered_html = ""
+    # Sort the sections into content blocks and the special slots
+    content_sections = []
     email_subject_text = ""
     email_start_text = ""
     email_end_text = ""
-    for section in final_data["sections"]:
-        # Ensure section is a dictionary and access its keys properly
-        #print(image_mappings.get(section["position"], ""))
-        if (isinstance(section, dict) and "content" in section) and section["length"] > 0 and section["position"] not in ["email-start", "email-end", "email-subject"]:
-            # Pass the section content into the template as "styledContent"
-            print("Processing section:", section["position"])
-            rendered_html += template.render(styledContent=section["content"], header_image=final_image_mappings.get(section["position"], ""))
-        elif section["position"] == "email-start" or section["position"] == "email-end" or section["position"] == "email-subject":
+    for section in position_content_list:
+        if (isinstance(section, dict) and "content" in section) and is_rendered_section(section):
+            content_sections.append(section)
+        elif section["position"] in SPECIAL_SECTIONS:
             if section["position"] == "email-start":
                 email_start_text = section["content"]
             elif section["position"] == "email-end":
                 email_end_text = section["content"]
             elif section["position"] == "email-subject":
-                email_subject_text = section["content"]
+                # Plain text for the title tag
+                email_subject_text = get_section_text(section)
         else:
             if section["length"] == 0:
                 print(f"Skipping section: {section['position']} (not filled in)")
             else:
                 print("Skipping invalid section:", section)
-            
 
+    def render_sections():
+        for section in content_sections:
+            # Pass the section content into the template as "styledContent"
+            print("Processing section:", section["position"])
+            context = {"styledContent": section["content"], "header_image": final_image_mappings.get(section["position"], "")}
+            if section_cache is not None:
+                key = make_key(SECTION_CACHE_VERSION, get_template_hash("section"), minify, context)
+                rendered = section_cache.get_rendered(key)
+                if rendered is None:
+                    rendered = template.render(**context)
+                    if minify:
+                        rendered = minify_html(rendered)
+                    section_cache.put_rendered(key, rendered)
+                yield section["position"], rendered
+            elif minify:
+                yield section["position"], minify_html(template.render(**context))
+            else:
+                for chunk in template.generate(**context):
+                    yield section["position"], chunk
 
-    social_html = ""
+    def prepare(html):
+        return minify_html(html) if minify else html
 
-    for social in final_social_data:
-        social_html += socials.render(
-            social_link=social["social_link"],
-            social_image=social["social_image"]
-        )
-        
-    # Extract plain text from email_subject_text for the title tag
-    email_subject_plain_text = ""
-    if email_subject_text:
-        soup = BeautifulSoup(email_subject_text, 'html.parser')
-        email_subject_plain_text = soup.get_text().strip()
+    # The shell (head, end and social block) only depends on config.py, so it is rendered once and cached
+    frame = load_frame(frame_cache_dir, final_image_mappings.get("logo"), final_social_data, minify)
     
-    start_html = start_template.render(
-        email_start=email_start_text,
-        header_image=final_image_mappings.get("logo"),
-        email_subject=email_subject_plain_text
-    )
-    
-    start_html = start_html.replace('<p class=', '<p dir="ltr" style="color: #F2F2F2;font-family: Helvetica;font-size: 14px;font-weight: bold;text-align: center;margin: 10px 0;padding: 0;mso-line-height-rule: exactly;-ms-text-size-adjust: 100%;-webkit-text-size-adjust: 100%;line-height: 150%;" class=')
+    return generate_frame(frame, {
+        "email_subject": email_subject_text,
+        "email_start": prepare(email_start_text),
+        "sections": render_sections(),
+        "email_end": prepare(email_end_text),
+    })
+
+class RenderedEmail(namedtuple("RenderedEmail", "html subject sections sizes timings unresolved_images")):
+    """A newsletter rendered by render_newsletter().
+
+    html is the complete email, subject the plain text of the email-subject
+    section and sections the positions of the content blocks in email order.
+    sizes maps each part of the email to its size in bytes (see
+    print_size_report()), timings maps "parse" and "render" to seconds, and
+    unresolved_images lists the image references that had no URL.
+    """
+
+    @property
+    def data(self):
+        """The email encoded as UTF-8, ready to send or save"""
+        return self.html.encode("utf-8")
 
-    end_html = end_template.render(
-        email_end=email_end_text
+def render_newsletter(document, image_urls=None, header_images=None, socials=None, sections=None,
+                      minify=False, section_cache=None, frame_cache_dir=None):
+    """Render a newsletter entirely in memory and return it as a RenderedEmail.
+
+    document is the exported HTML as a string, bytes or a file-like object.
+    image_urls maps the export's image file names to the URLs to use,
+    header_images maps section positions (and "logo") to URLs, and socials is a
+    list like social_data in config.py; header_images and socials default to the
+    ones in config.py. Pass sections if the document has already been parsed.
+    Nothing is uploaded, and nothing is written to disk unless a section cache or
+    frame_cache_dir is given; the shell is otherwise only cached in memory.
+    """
+    started = time.perf_counter()
+    if hasattr(document, "read"):
+        document = document.read()
+    if isinstance(document, bytes):
+        document = document.decode("utf-8")
+    if sections is None:
+        sections = parse_sections(document, section_cache)
+    parsed = time.perf_counter()
+
+    unresolved = set()
+    chunks = []
+    sizes = count_chunk_sizes(render_email(document, image_urls, header_images, socials, sections, minify, section_cache,
+                                           unresolved, frame_cache_dir), chunks.append)
+    rendered = time.perf_counter()
+
+    subject = next((get_section_text(section) for section in sections if section["position"] == "email-subject"), "")
+    return RenderedEmail(
+        html="".join(chunks),
+        subject=subject,
+        sections=[section["position"] for section in sections if is_rendered_section(section)],
+        sizes=sizes,
+        timings={"parse": parsed - started, "render": rendered - parsed},
+        unresolved_images=sorted(unresolved),
     )
-    
-    end_html = end_html.replace('<p class=', '<p dir="ltr" style="color: #F2F2F2;font-family: Helvetica;font-size: 14px;font-weight: bold;text-align: center;margin: 10px 0;padding: 0;mso-line-height-rule: exactly;-ms-text-size-adjust: 100%;-webkit-text-size-adjust: 100%;line-height: 150%;" class=')
 
-        
-    # Output the rendered HTML
-    #print(rendered_html)
-    current_datetime = datetime.datetime.now()
-    current_date = current_datetime.strftime("%Y-%m-%d")
-    current_time = current_datetime.strftime("%H-%M-%S")
-    
-    # Create emails directory if it doesn't exist
-    emails_dir = "emails"
-    os.makedirs(emails_dir, exist_ok=True)
-    
-    filename = f"mps-email-{current_date}-{current_time}.html"
-    filepath = os.path.join(emails_dir, filename)
-    
-    with open(filepath, "w", encoding="utf-8") as output_file:
+def count_chunk_sizes(chunks, write):
+    """Pass each chunk of (label, chunk) pairs to write, returning the UTF-8 size of each label's chunks"""
+    sizes = {}
+    for label, chunk in chunks:
+        sizes[label] = sizes.get(label, 0) + len(chunk.encode("utf-8"))
+        write(chunk)
+    return sizes
 
-        rendered_html = rendered_html.replace('<p class=', '<p dir="ltr" style="color: #F2F2F2;font-family: Helvetica;font-size: 14px;font-weight: bold;text-align: center;margin: 10px 0;padding: 0;mso-line-height-rule: exactly;-ms-text-size-adjust: 100%;-webkit-text-size-adjust: 100%;line-height: 150%;" class=')
-    
-        output_file.write(start_html + rendered_html + end_html + social_html + end_after_social)
+def write_email(html, name=None):
+    """Write an email to a new timestamped file in emails/ (see get_output_path()), returning its path"""
+    filepath = get_output_path(name)
+    # Write next to the final file and rename, so a failed write never leaves half an email behind
+    tmp_path = f"{filepath}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as output_file:
+        output_file.write(html)
+    os.replace(tmp_path, filepath)
+    return filepath
+
+def generate_email(html_content, image_upload_mapping=None, updated_image_mappings=None, updated_social_data=None, sections=None,
+                   minify=False, size_budget_kb=None, section_cache=None, name=None):
+    """Render the newsletter and write it to emails/, returning the path of the file.
 
+    The email is streamed to the file: the cached shell and each section's
+    rendered chunks are written as they are produced, so the full email is never
+    held in memory as one string. The size of every part is reported, and
+    BuildError is raised (after writing the file) when the email is over
+    size_budget_kb. name is added to the file name, so issues built at the same
+    time do not collide.
+    """
+    chunks = render_email(html_content, image_upload_mapping, updated_image_mappings, updated_social_data, sections,
+                          minify, section_cache, frame_cache_dir=frame_cache_dir)
+
+    filepath = get_output_path(name)
+    
+    # Write next to the final file and rename, so a failed render never leaves half an email behind
+    tmp_path = f"{filepath}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as output_file:
+        sizes = count_chunk_sizes(chunks, output_file.write)
+    os.replace(tmp_path, filepath)
 
     print(f"HTML file generated successfully as {filepath}")
-    return rendered_html
+    total = print_size_report(sizes, size_budget_kb)
+    if over_budget(total, size_budget_kb):
+        raise BuildError(f"The email is {format_kb(total)}, over the {size_budget_kb} KB budget "
+                         f"(Gmail clips messages over {GMAIL_CLIP_KB} KB)")
+    return filepath
 
 
 if __name__ == "__main__":
@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+# main.py and lib/ are imported from the repository root, as when running main.py
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+@pytest.fixture
+def in_repo(monkeypatch):
+    """Run from the repository root, which config.py's asset paths are relative to"""
+    monkeypatch.chdir(REPO_ROOT)
@@ -0,0 +1,119 @@
+import argparse
+import hashlib
+import time
+import zipfile
+
+import pytest
+
+import main
+from lib.image_cache import ImageCache
+from lib.image_hosts import ImageHost, LocalDirectoryHost
+from lib.upload_queue import UploadQueue
+
+class RejectingHost(ImageHost):
+    """Stands in for postimages.org (whose cache keys have no namespace) and rejects every upload"""
+
+    name = "postimages"
+
+    def upload(self, filename, fileobj):
+        return None
+
+class CountingHost(ImageHost):
+    """Resolves every page URL to a direct link, recording each lookup"""
+
+    name = "postimages"
+
+    def __init__(self):
+        super().__init__()
+        self.lookups = []
+
+    def resolve_direct_link(self, page_url):
+        self.lookups.append(page_url)
+        return f"{page_url}/direct.png"
+
+def write_export(zip_path, images):
+    """Write a newsletter export whose Events section shows each of images ({filename: bytes})"""
+    image_tags = "".join(f'<p><span><img src="images/{filename}"></span></p>' for filename in images)
+    document = ('<html><body>'
+                '<p><span>&mdash; Email Subject</span></p><p><span>Test issue</span></p>'
+                '<p><span>&mdash; Events</span></p><p><span>Events text</span></p>' + image_tags +
+                '<p><span>&mdash; Email End</span></p><p><span>Bye!</span></p>'
+                '</body></html>')
+    with zipfile.ZipFile(zip_path, 'w') as zip_ref:
+        zip_ref.writestr("Newsletter.html", document)
+        for filename, data in images.items():
+            zip_ref.writestr(f"images/{filename}", data)
+    return str(zip_path)
+
+def upload_export(zip_path, host, image_cache, upload_queue, resume=False):
+    """Find or upload every image an export uses, as a build does"""
+    args = argparse.Namespace(resume=resume, retina=True)
+    with zipfile.ZipFile(zip_path) as zip_ref:
+        html_content, images_list = main.read_zip_contents(zip_ref)
+        sections = main.parse_sections(html_content)
+        image_upload_mapping, all_images, missing_images = main.upload_zip_images(
+            args, zip_path, zip_ref, sections, images_list, host, image_cache, upload_queue, 2, False)
+    return image_upload_mapping
+
+@pytest.fixture
+def caches(tmp_path, in_repo, monkeypatch):
+    # A manifest left by `python main.py manifest` would bypass the image cache
+    monkeypatch.setattr(main, "asset_manifest_path", None)
+    db_path = str(tmp_path / "image_cache.db")
+    with ImageCache(db_path) as image_cache, UploadQueue(db_path) as upload_queue:
+        yield image_cache, upload_queue
+
+def test_resume_leaves_uploads_queued_for_another_host(tmp_path, caches):
+    image_cache, upload_queue = caches
+    zip_path = write_export(tmp_path / "news.zip", {"image1.png": b"first image"})
+
+    upload_export(zip_path, RejectingHost(), image_cache, upload_queue)
+    queued = {item["cache_key"] for item in upload_queue.items()}
+    assert queued
+
+    local_host = LocalDirectoryHost(str(tmp_path / "hosted"))
+    image_upload_mapping = upload_export(zip_path, local_host, image_cache, upload_queue, resume=True)
+
+    # The local upload is cached under the local namespace only
+    assert image_upload_mapping["image1.png"].startswith("file://")
+    assert all(image_cache.get_entry(cache_key) is None for cache_key in queued)
+    assert {item["cache_key"] for item in upload_queue.items()} == queued
+
+def test_upload_images_refuses_another_hosts_keys(tmp_path):
+    image_path = tmp_path / "image1.png"
+    image_path.write_bytes(b"first image")
+    bare_key = hashlib.sha256(b"first image").hexdigest()
+
+    with pytest.raises(main.BuildError):
+        main.upload_images(LocalDirectoryHost(str(tmp_path / "hosted")), [(str(image_path), "image1.png", bare_key)])
+
+def test_pending_direct_link_reaches_every_copy_of_an_image(tmp_path, caches):
+    image_cache, upload_queue = caches
+    zip_path = write_export(tmp_path / "news.zip", {"image2.jpg": b"same image", "image3.jpg": b"same image"})
+    host = LocalDirectoryHost(str(tmp_path / "hosted"))
+    # Uploaded by an earlier run whose direct link lookup failed
+    cache_key = main.get_cache_key(hashlib.sha256(b"same image").hexdigest(), None, host)
+    image_cache.put(cache_key, None, "file:///hosted/same.jpg")
+
+    image_upload_mapping = upload_export(zip_path, host, image_cache, upload_queue)
+
+    assert image_upload_mapping["image2.jpg"] == image_upload_mapping["image3.jpg"] == "file:///hosted/same.jpg"
+
+def test_resolve_direct_links_looks_up_each_hash_once():
+    host = CountingHost()
+    pending = [("image2.jpg", "hash", "https://postimg.cc/abc"), ("image3.jpg", "hash", "https://postimg.cc/abc")]
+
+    resolved = main.resolve_direct_links(host, pending, workers=2)
+
+    assert sorted(resolved) == [("image2.jpg", "hash", "https://postimg.cc/abc/direct.png"),
+                                ("image3.jpg", "hash", "https://postimg.cc/abc/direct.png")]
+    assert host.lookups == ["https://postimg.cc/abc"]
+
+def test_prune_keeps_entries_a_build_used(tmp_path):
+    with ImageCache(str(tmp_path / "image_cache.db")) as image_cache:
+        image_cache.put("used", "https://i.postimg.cc/used.png", uploaded_at=0)
+        image_cache.put("unused", "https://i.postimg.cc/unused.png", uploaded_at=0)
+        image_cache.mark_used(["used"], used_at=time.time())
+
+        assert image_cache.prune(older_than_days=180) == 1
+        assert image_cache.get("used") and image_cache.get("unused") is None
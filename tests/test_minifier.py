@@ -0,0 +1,23 @@
+from lib.minifier import minify_css, minify_html
+
+def test_minify_css_removes_comments_spacing_and_trailing_semicolons():
+    assert minify_css("/* note */ p , a > b { color : red ; margin: 0 ; }") == "p,a>b{color :red;margin:0}"
+
+def test_minify_css_leaves_quoted_strings_alone():
+    css = 'a[title="x ; y"] { color: red; }\nb { content: ";}"; }'
+    assert minify_css(css) == 'a[title="x ; y"]{color:red}b{content:";}"}'
+
+def test_minify_css_keeps_at_rules_whole():
+    css = "@import url(x.css);\n@media (max-width: 600px) { p { margin: 0; } }"
+    assert minify_css(css) == "@import url(x.css);@media (max-width:600px){p{margin:0}}"
+
+def test_minify_html_collapses_whitespace_and_drops_comments():
+    html = "<div>\n  <p>Hello   <b>big</b>\n world</p>\n<!-- note -->\n</div>"
+    assert minify_html(html) == "<div><p>Hello <b>big</b> world</p></div>"
+
+def test_minify_html_keeps_conditional_comments_and_pre():
+    html = "<div>\n<!--[if mso]><table><![endif]-->\n<pre>  keep\n  this </pre></div>"
+    assert minify_html(html) == "<div><!--[if mso]><table><![endif]--><pre>  keep\n  this </pre></div>"
+
+def test_minify_html_minifies_style_blocks():
+    assert minify_html("<style> a { color : red ; } </style>") == "<style>a{color :red}</style>"
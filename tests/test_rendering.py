@@ -0,0 +1,26 @@
+from lib.css_inliner import parse_stylesheet
+import main
+
+def test_rewrite_image_sources_points_references_at_hosted_urls():
+    content = '<img src="images/a.png"><img src=\'./images/b.png\'><img src="images/c.png">'
+    unresolved = set()
+
+    rewritten = main.rewrite_image_sources(content, {"a.png": "https://x/a.png", "b.png": "https://x/b.png"}, unresolved)
+
+    assert rewritten == '<img src="https://x/a.png"><img src="https://x/b.png"><img src="images/c.png">'
+    assert unresolved == {"c.png"}
+
+def test_parse_stylesheet_indexes_class_rules():
+    css = ".c1{font-weight:700}p.c2{color:#000; margin:0}/* .c9{color:red} */.c3{padding:0}"
+
+    assert parse_stylesheet(css) == {
+        "c1": [(None, {"font-weight": "700"}, 0)],
+        "c2": [("p", {"color": "#000", "margin": "0"}, 1)],
+        "c3": [(None, {"padding": "0"}, 2)],
+    }
+
+def test_parse_stylesheet_skips_selectors_email_clients_ignore():
+    css = ('@import url(a.css);@media (max-width:600px){.c1{color:red}}'
+           '.a .b{color:blue}ol.lst-kix li:before{content:"x"}.c1{color:green}')
+
+    assert parse_stylesheet(css) == {"c1": [(None, {"color": "green"}, 0)]}